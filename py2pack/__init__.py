@@ -14,30 +14,44 @@
 # limitations under the License.
 
 import argparse
+import collections
+import concurrent.futures
+import copy
 import platformdirs
 import datetime
 import glob
+import hashlib
 import os
 import pprint
 import re
 import json
+import multiprocessing
 import sys
 import warnings
+import zipfile
+from io import StringIO
 
 import jinja2
-import pypi_search.search
 import requests
-from metaextract import utils as meta_utils
 from caseless import CaselessDict
+import py2pack.buildenv
+import py2pack.cache
+import py2pack.classify
+import py2pack.index
+import py2pack.network
 import py2pack.requires
+import py2pack.sandbox
+import py2pack.static
 from py2pack import version as py2pack_version
-from py2pack.utils import (_get_archive_filelist, get_pyproject_table,
+from py2pack.utils import (ArchiveIndex, get_pyproject_table,
                            parse_pyproject, get_setuptools_scripts,
                            get_metadata, get_user_name, no_ending_dot,
                            single_line, pypi_archive_file,
-                           pypi_json_file, pypi_text_file,
-                           pypi_text_metaextract)
-from packaging.requirements import Requirement
+                           pypi_json_file, pypi_text_file, pypi_text_stream,
+                           pypi_text_metaextract, read_wheel, is_wheel,
+                           wheel_is_pure, record_has_ext_modules)
+from packaging.markers import default_environment
+from packaging.utils import canonicalize_name
 
 try:
     import distro
@@ -64,17 +78,54 @@ with open(SPDX_LICENSES_FILE, 'r') as fp:
     SPDX_LICENSES = json.load(fp)
 
 
-def pypi_json(project, release=None):
+def pypi_json(project, release=None, cache=None):
     """Access the PyPI JSON API
 
     https://warehouse.pypa.io/api-reference/json.html
+
+    If a py2pack.cache.HTTPCache is given, the response is served from and
+    stored in it.
     """
     version = ('/' + release) if release else ''
-    with requests.get('https://pypi.org/pypi/{}{}/json'.format(project, version)) as r:
+    url = 'https://pypi.org/pypi/{}{}/json'.format(project, version)
+    if cache is not None:
+        return cache.get_json(url)
+    with py2pack.network.get(url) as r:
         pypimeta = r.json()
     return pypimeta
 
 
+def _core_metadata_release(args):
+    """the url entry of the fetched release which has a PEP 658 core
+    metadata file, preferably the sdist, or None"""
+    releases = [release for release in args.fetched_data.get('urls', [])
+                if release.get('core-metadata') or release.get('data-dist-info-metadata')]
+    releases.sort(key=lambda release: release.get('packagetype') != 'sdist')
+    return releases[0] if releases else None
+
+
+def pypi_core_metadata(release, cache=None):
+    """Access the core metadata file of a distribution (PEP 658)
+
+    https://peps.python.org/pep-0658/
+
+    release is an entry of the "urls" of the PyPI JSON API. The file is
+    parsed with pypi_text_stream and checked against its published sha256.
+    """
+    url = release['url'] + '.metadata'
+    digests = release.get('core-metadata') or release.get('data-dist-info-metadata')
+    sha256 = digests.get('sha256') if isinstance(digests, dict) else None
+    if cache is not None:
+        # the cache checks the digest before it stores the body
+        return pypi_text_stream(StringIO(cache.get_text(url, sha256)))
+    with py2pack.network.get(url) as r:
+        r.raise_for_status()
+        content = r.content
+    if sha256 and hashlib.sha256(content).hexdigest() != sha256.lower():
+        raise py2pack.network.DigestMismatch("sha256 of '{}' does not match".format(url))
+    return pypi_text_stream(StringIO(content.decode('utf-8')))
+
+
 def _get_template_dirs():
     """existing directories where to search for jinja2 templates. The order
     is important. The first found template from the first found dir wins!"""
@@ -103,7 +154,7 @@ def fix_data(args):
     requires_dist = data_info.get("requires_dist", []) or []
     provides_extra = data_info.get("provides_extra", []) or []
     for required_dist in requires_dist:
-        req = Requirement(required_dist)
+        req = py2pack.requires._parse_requirement(required_dist)
         if found := extra_from_req.search(str(req.marker)):
             extras.append(found.group(1))
     provides_extra = list(sorted(set([*extras, *provides_extra])))
@@ -133,19 +184,35 @@ def _get_homepage(urls):
 
 
 def list_packages(args=None):
-    """query the "Simple API" of PYPI for all packages and print them."""
+    """query the "Simple API" of PYPI for all packages and print them.
+
+    The project list is kept in a local copy which is synced incrementally,
+    see py2pack.index.
+    """
     print('listing all PyPI packages...')
-    with requests.get('https://pypi.org/simple/') as r:
-        html = r.text
-    simplere = re.compile(r'<a href="/simple/.+">(.*)</a>')
-    for package in simplere.findall(html):
+    if args and args.no_cache:
+        with py2pack.index.SimpleIndex().projects() as (_, names):
+            for package in names:
+                print(package)
+        return
+    cache_dir = args and args.cache_dir
+    for package in py2pack.index.ProjectList(py2pack.cache.cache_path('simple', cache_dir)).sync():
         print(package)
 
 
 def search(args):
+    """search the project names of the local copy of the "Simple API".
+
+    The local copy is created on first use and updated with --refresh, so
+    searching works without network access afterwards.
+    """
     print('searching for package {0}...'.format(args.name))
-    for hit in pypi_search.search.find_packages(args.name):
-        print('found {0}-{1}'.format(hit['name'], hit['version']))
+    project_list = py2pack.index.ProjectList(py2pack.cache.cache_path('simple', args.cache_dir))
+    if args.refresh or project_list.meta() is None:
+        project_list.update()
+    index = py2pack.index.NameIndex.for_project_list(project_list)
+    for name in index.search(args.name, limit=args.limit):
+        print('found {0}'.format(name))
 
 
 def show(args):
@@ -160,12 +227,18 @@ def fetch(args):
     if not url:
         print("unable to find a source release for {0}!".format(args.name))
         sys.exit(1)
+    sha256 = url.get('digests', {}).get('sha256')
+    if py2pack.network.file_matches_digest(url['filename'], sha256):
+        print('package {0}-{1} is already downloaded'.format(args.name, args.version))
+        return
     print('downloading package {0}-{1}...'.format(args.name, args.version))
     print('from {0}'.format(url['url']))
 
-    with requests.get(url['download_url']) as r:
-        with open(url['filename'], 'wb') as f:
-            f.write(r.content)
+    try:
+        py2pack.network.download(url['download_url'], url['filename'], sha256=sha256)
+    except (requests.HTTPError, py2pack.network.DigestMismatch) as exc:
+        print('unable to download {0}: {1}'.format(url['filename'], exc))
+        sys.exit(1)
 
 
 def _canonicalize_setup_data(data):
@@ -280,11 +353,93 @@ def _quote_shell_metacharacters(string):
     return string
 
 
+def _archive_cache_dir(args):
+    """directory of the stored archive indexes, None when not caching"""
+    if args.cache is None:
+        return None
+    return py2pack.cache.cache_path('archives', args.cache_dir)
+
+
+def _build_env_pool(args):
+    """pool of the cached build environments, None when not caching"""
+    if args.cache is None:
+        return None
+    return py2pack.buildenv.BuildEnvPool(py2pack.cache.cache_path('build-envs', args.cache_dir),
+                                         args.build_envs or py2pack.buildenv.DEFAULT_MAX_ENVS,
+                                         args.wheelhouse)
+
+
+def _analysis_cache(args):
+    """store of _augment_data_from_tarball results, None when not caching"""
+    if args.cache is None:
+        return None
+    return py2pack.cache.ResultCache(py2pack.cache.cache_path('analysis', args.cache_dir))
+
+
+# template data which does not influence the analysis of the archive
+_ANALYSIS_IGNORED_DATA = ('year', 'user_name', 'source_url')
+
+
+def _analysis_key(args, digest, data):
+    inputs = {field: value for field, value in data.items() if field not in _ANALYSIS_IGNORED_DATA}
+    # the requirement markers are evaluated for, data_files is built from
+    # and setup.py runs with the running interpreter
+    interpreter = [default_environment(), sys.prefix]
+    serialized = json.dumps([py2pack_version.version, digest, args.name, args.version, inputs, interpreter],
+                            sort_keys=True, default=repr)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
 def _augment_data_from_tarball(args, filename, data):
-    docs_re = re.compile(r"{0}-{1}\/((?:AUTHOR|ChangeLog|CHANGES|NEWS|README).*)".format(args.name, args.version), re.IGNORECASE)
-    license_re = re.compile(r"{0}-{1}\/((?:COPYING|LICENSE).*)".format(args.name, args.version), re.IGNORECASE)
+    """Add the information found in the archive filename to data.
 
-    data_pyproject = parse_pyproject(filename)
+    The changes are kept in the analysis cache, keyed by the sha256 of the
+    archive, the py2pack version, the data and the running interpreter, so analyzing the same archive
+    again, e.g. for another template, does not run setup.py or the build
+    backend. Analyses which failed in part are not cached. Wheels are read
+    with _augment_data_from_wheel_file instead.
+    """
+    if is_wheel(filename):
+        _augment_data_from_wheel_file(args, filename, data)
+        return
+    if isinstance(filename, ArchiveIndex):
+        index = filename
+    else:
+        index = ArchiveIndex.for_archive(filename, _archive_cache_dir(args),
+                                         streaming=bool(args.stream_archives))
+    cache = _analysis_cache(args)
+    if cache is None or index.digest is None:
+        _augment_data_from_archive(args, index, data)
+        return
+    key = _analysis_key(args, index.digest, data)
+    changes = cache.get(key)
+    if changes is None:
+        before = copy.deepcopy(data)
+        complete = _augment_data_from_archive(args, index, data)
+        changes = ({field: value for field, value in data.items()
+                    if field not in before or before[field] != value},
+                   [field for field in before if field not in data])
+        if complete:
+            cache.put(key, changes)
+        return
+    updated, removed = changes
+    data.update(updated)
+    for field in removed:
+        data.pop(field, None)
+
+
+def _augment_data_from_archive(args, index, data):
+    """analyze the archive of index, returns False if parts of the analysis
+    failed
+
+    data['metadata_source'] tells where the metadata was read from: the
+    static "setup.py" and setup.cfg, "metaextract", the "PKG-INFO" or
+    "pyproject.toml" or the "build backend".
+    """
+    complete = True
+
+    filename = index.filename
+    data_pyproject = parse_pyproject(index)
     if data_pyproject is not None and "license" in data and data["license"] in SPDX_LICENSES:
         # Trust the PyPI Metadata and don't try to update with a possible non SPDX identifier
         data_pyproject.pop("license", None)
@@ -298,37 +453,122 @@ def _augment_data_from_tarball(args, filename, data):
 
     if any(['setuptools' in br for br in buildrequires]):
         try:
-            data_archive = meta_utils.from_archive(filename)
-            data.update(data_archive['data'])
+            data_setup, source = py2pack.static.setup_metadata(index), 'setup.py'
+            if data_setup is None:
+                data_setup, source = py2pack.sandbox.from_archive(filename)['data'], 'metaextract'
+            data.update(data_setup)
+            data['metadata_source'] = source
         except Exception as exc:
+            complete = False
             warnings.warn("Could not get setuptools information from tarball {}: {}. "
                           "Valuable information for the generation might be missing."
                           .format(filename, exc))
     else:
         try:
-            mdata = get_metadata(filename)
+            mdata, source = py2pack.static.core_metadata(index)
+            if mdata is None:
+                mdata = get_metadata(index, work_dir=args.work_dir, build_envs=_build_env_pool(args))
+                source = 'build backend'
             data.update(mdata)
+            data['metadata_source'] = source
         except Exception as exc:
+            complete = False
             warnings.warn("Could not get metadata information from tarball {}: {}. "
                           "Valuable information for the generation might be missing."
                           .format(filename, exc))
 
-    names = _get_archive_filelist(filename)
     _canonicalize_setup_data(data)
 
-    for name in names:
-        match_docs = re.match(docs_re, name)
-        match_license = re.match(license_re, name)
-        if match_docs:
-            data.setdefault('doc_files', []).append(
-                _quote_shell_metacharacters(match_docs.group(1)))
-        if match_license:
-            data.setdefault('license_files', []).append(
-                _quote_shell_metacharacters(match_license.group(1))
-            )
-        # Very broad check for testsuites
-        if "test" in name.lower():
-            data["testsuite"] = True
+    root = '{0}-{1}'.format(args.name, args.version)
+    for field, value in py2pack.classify.template_data(index.tags, root).items():
+        if value is True:
+            data[field] = True
+        else:
+            data.setdefault(field, []).extend(_quote_shell_metacharacters(path) for path in value)
+    return complete
+
+
+def _augment_data_from_core_metadata(args, data):
+    """add the requirements from the PEP 658 core metadata file to data
+
+    Returns:
+        True if a core metadata file was found
+    """
+    release = _core_metadata_release(args)
+    if release is None:
+        return False
+    try:
+        metadata = pypi_core_metadata(release, cache=args.cache)['info']
+    except (requests.RequestException, py2pack.network.DigestMismatch) as exc:
+        warnings.warn("Could not get the core metadata of {}: {}".format(args.name, exc))
+        return False
+    data['install_requires'] = py2pack.requires._requirements_sanitize(
+        metadata.get('requires_dist', []))
+    return True
+
+
+def _wheel_releases(args):
+    """the url entries of the wheels of the fetched release, the ones
+    without extension modules first"""
+    wheels = [release for release in args.fetched_data.get('urls', [])
+              if release.get('packagetype') == 'bdist_wheel']
+    wheels.sort(key=lambda release: not wheel_is_pure(release['filename']))
+    return wheels
+
+
+def _augment_data_from_wheels(args, data):
+    """add the requirements, scripts and whether there are extension modules
+    from the wheels of the release to data
+
+    has_ext_modules is known from the tags of the wheels, the rest is read
+    from the .dist-info directory of one wheel, without downloading it.
+
+    Returns:
+        True if a wheel was found
+    """
+    wheels = _wheel_releases(args)
+    if not wheels:
+        return False
+    try:
+        files = read_wheel(wheels[0]['url'])
+    except (requests.RequestException, zipfile.BadZipFile, KeyError) as exc:
+        warnings.warn("Could not read the wheel of {}: {}".format(args.name, exc))
+        return False
+    _add_wheel_data(data, files, not all(wheel_is_pure(wheel['filename']) for wheel in wheels))
+    return True
+
+
+def _augment_data_from_wheel_file(args, filename, data):
+    """add the requirements, scripts and whether there are extension modules
+    from the local wheel filename to data
+
+    Only the central directory of the wheel and the .dist-info files are
+    read, nothing is extracted or built.
+    """
+    if isinstance(filename, ArchiveIndex):
+        filename = filename.filename
+    try:
+        files = read_wheel(filename, ('METADATA', 'entry_points.txt', 'RECORD'))
+    except (OSError, zipfile.BadZipFile, KeyError) as exc:
+        warnings.warn("Could not read the wheel {}: {}. "
+                      "Valuable information for the generation might be missing."
+                      .format(filename, exc))
+        return
+    has_ext_modules = (not wheel_is_pure(os.path.basename(filename)) or
+                       record_has_ext_modules(files.get('RECORD', '')))
+    _add_wheel_data(data, files, has_ext_modules)
+
+
+def _add_wheel_data(data, files, has_ext_modules):
+    """add the data of the .dist-info files of a wheel read by read_wheel"""
+    metadata = pypi_text_stream(StringIO(files['METADATA']))['info']
+    data['install_requires'] = py2pack.requires._requirements_sanitize(
+        metadata.get('requires_dist', []))
+    console_scripts = get_setuptools_scripts({'entry_points': files.get('entry_points.txt')})
+    if console_scripts:
+        data['console_scripts'] = console_scripts
+    data['has_ext_modules'] = has_ext_modules
+    data['metadata_source'] = 'wheel'
 
 
 def _license_from_classifiers(data):
@@ -373,24 +613,20 @@ def _get_source_url(pypi_name, filename):
         pypi_name[0], pypi_name, filename)
 
 
-def generate(args):
-    # TODO (toabctl): remove this is a later release
-    if args.run:
-        warnings.warn("the '--run' switch is deprecated and a noop",
-                      DeprecationWarning)
+def _download_sdist(args):
+    """download the newest sdist of the fetched package to the current
+    directory and return its filename, None if there is nothing to download"""
+    url = newest_download_url(args)
+    if not url:
+        return None
+    sha256 = url.get('digests', {}).get('sha256')
+    py2pack.network.download(url['download_url'], url['filename'], sha256=sha256)
+    return url['filename']
 
-    fetch_data(args)
-    if not args.template:
-        args.template = file_template_list()[0]
-    if not args.filename:
-        args.filename = "python-" + args.name + '.' + args.template.rsplit('.', 1)[1]   # take template file ending
-    print('generating spec file for {0}...'.format(args.name))
-    data = args.fetched_data['info']
-    durl = newest_download_url(args)
-    source_url = data['source_url'] = durl and durl['download_url']
-    data['year'] = datetime.datetime.now().year                             # set current year
-    data['user_name'] = args.maintainer or get_user_name()                   # set system user (packager)
 
+def _local_archives(args):
+    """the archives of the fetched package in the current directory matching
+    --source-glob, without the partial files of running downloads"""
     # If package name supplied on command line differs in case from PyPI's one
     # then package archive will be fetched but the name will be the one from PyPI.
     # Eg. send2trash vs Send2Trash. Check that.
@@ -399,14 +635,41 @@ def generate(args):
     name = args.name
     default_source = '%{name}-%{version}.*'
     source_glob = args.source_glob or default_source
-    data_name = data['name'] or name
+    data_name = args.fetched_data['info']['name'] or name
 
     tarball_file = []
     for __name in (name, name.translate(tr), data_name, data_name.translate(tr)):
-        tarball_file.extend(glob.glob(replace_string(source_glob, {'name': __name, 'version': version})))
+        tarball_file.extend(
+            filename for filename in glob.glob(replace_string(source_glob, {'name': __name, 'version': version}))
+            if not filename.endswith('.part'))
         if tarball_file:
             break
+    return tarball_file
+
+
+def _prepare_generate_data(args, sdist=None):
+    """Collect the template data of the fetched package.
+
+    If no local archive is found and sdist is given, it is called to get the
+    filename of the downloaded sdist instead. With args.core_metadata, the
+    PEP 658 core metadata file is used in place of a missing archive, with
+    args.wheel the wheels of the release.
+
+    Returns:
+        (data, tarball_file, archive) where archive is the file to analyze
+        with _augment_data_from_tarball or None if there is none
+    """
+    if not args.template:
+        args.template = file_template_list()[0]
+    if not args.filename:
+        args.filename = "python-" + args.name + '.' + args.template.rsplit('.', 1)[1]   # take template file ending
+    data = args.fetched_data['info']
+    durl = newest_download_url(args)
+    data['source_url'] = durl and durl['download_url']
+    data['year'] = datetime.datetime.now().year                             # set current year
+    data['user_name'] = args.maintainer or get_user_name()                   # set system user (packager)
 
+    tarball_file = _local_archives(args)
     localarchive = args.localarchive
     if tarball_file:                                                        # get some more info from that
         tarball_file = tarball_file[0]
@@ -416,15 +679,31 @@ def generate(args):
         tarball_file = args.name + '-' + args.version + '.tar.gz'
 
     if localarchive:
-        _augment_data_from_tarball(args, localarchive, data)
+        archive = localarchive
     elif os.path.exists(tarball_file):
-        _augment_data_from_tarball(args, tarball_file, data)
+        archive = tarball_file
     else:
+        archive = None
+        if sdist is not None:
+            try:
+                archive = sdist()
+            except (requests.RequestException, py2pack.network.DigestMismatch) as exc:
+                warnings.warn("Could not download the sdist of {}: {}".format(args.name, exc))
+        if archive:
+            tarball_file = archive
+        elif args.core_metadata and _augment_data_from_core_metadata(args, data):
+            return data, tarball_file, archive
+        elif args.wheel and _augment_data_from_wheels(args, data):
+            return data, tarball_file, archive
+    if not archive:
         warnings.warn("No tarball for {} in version {} found. Valuable "
                       "information for the generation might be missing."
                       "".format(args.name, args.version))
+    return data, tarball_file, archive
+
 
-    if not source_url:
+def _finish_generate_data(args, data, tarball_file):
+    if not data['source_url']:
         data['source_url'] = os.path.basename(tarball_file)
 
     _normalize_license(data)
@@ -437,16 +716,219 @@ def generate(args):
     data['no_ending_dot'] = no_ending_dot
     data['single_line'] = single_line
 
-    env = _prepare_template_env(_get_template_dirs())
-    template = env.get_template(args.template)
+
+def _render(template, data, filename):
     result = template.render(data).encode('utf-8')                          # render template and encode properly
-    outfile = open(args.filename, 'wb')                                     # write result to spec file
+    outfile = open(filename, 'wb')                                          # write result to spec file
     try:
         outfile.write(result)
     finally:
         outfile.close()
 
 
+def generate(args):
+    # TODO (toabctl): remove this is a later release
+    if args.run:
+        warnings.warn("the '--run' switch is deprecated and a noop",
+                      DeprecationWarning)
+
+    fetch_data(args)
+    print('generating spec file for {0}...'.format(args.name))
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        # with --fetch the sdist downloads while the template is loaded and
+        # the metadata is prepared, it is analyzed as soon as it is complete.
+        # A local archive is used instead if there is one.
+        prefetch = None
+        if args.fetch and not args.localarchive and not _local_archives(args):
+            prefetch = executor.submit(_download_sdist, args)
+        if not args.template:
+            args.template = file_template_list()[0]
+        template = _prepare_template_env(_get_template_dirs()).get_template(args.template)
+        data, tarball_file, archive = _prepare_generate_data(args, prefetch and prefetch.result)
+    if archive:
+        _augment_data_from_tarball(args, archive, data)
+    _finish_generate_data(args, data, tarball_file)
+    _render(template, data, args.filename)
+
+
+def _read_package_list(args):
+    """Return (name, version) tuples from the command line and --input.
+
+    The input file has one package per line, optionally followed by a
+    version. Empty lines and comments starting with '#' are ignored.
+    """
+    lines = list(args.names or [])
+    if args.input:
+        with (sys.stdin if args.input == '-' else open(args.input)) as fh:
+            lines.extend(fh)
+    packages = []
+    for line in lines:
+        fields = line.split('#', 1)[0].replace('==', ' ').split()
+        if fields:
+            packages.append((fields[0], fields[1] if len(fields) > 1 else None))
+    return packages
+
+
+def _package_args(args, name, version):
+    pkg_args = Munch(args)
+    pkg_args.name = name
+    pkg_args.version = version
+    pkg_args.filename = None
+    pkg_args.localfile = None
+    pkg_args.localarchive = None
+    pkg_args.fetched_data = None
+    return pkg_args
+
+
+def _fetch_and_prepare(args):
+    """fetch the metadata of a package and prepare its template data"""
+    try:
+        fetch_data(args)
+    except SystemExit:
+        raise Exception("unable to find a suitable release")
+    sdist = (lambda: _download_sdist(args)) if args.fetch else None
+    data, tarball_file, archive = _prepare_generate_data(args, sdist)
+    if args.output_dir:
+        args.filename = os.path.join(args.output_dir, args.filename)
+    return data, tarball_file, archive
+
+
+# the options _augment_data_from_tarball uses, passed to the process pool
+ANALYZE_OPTIONS = ('cache', 'cache_dir', 'work_dir', 'build_envs', 'wheelhouse', 'stream_archives')
+
+
+def _setup_py_pool_options(args):
+    """py2pack.sandbox.SetupPyPool arguments of the command line options"""
+    return {'max_workers': args.setup_jobs, 'timeout': args.setup_timeout,
+            'memory': args.setup_memory}
+
+
+def _configure_setup_py_pool(options, slots=None):
+    """process pool initializer, the workers do not inherit the shared pool.
+    slots is the semaphore bounding the setup.py workers of all processes."""
+    py2pack.sandbox.configure_pool(slots=slots, **options)
+
+
+def _analyze_archive(name, version, archive, data, options):
+    """process pool entry point for _augment_data_from_tarball"""
+    _augment_data_from_tarball(Munch(dict(options, name=name, version=version)), archive, data)
+    return data
+
+
+def _requirement_names(data):
+    """names of the requirements of the package valid on this platform"""
+    requires = py2pack.requires._requirements_sanitize(data.get('requires_dist', []))
+    return [req.split()[0] for req in requires]
+
+
+def _existing_packages(directory):
+    """normalized names of the packages with a recipe in directory
+
+    Matches spec/dsc files and package directories named python-<name>.
+    """
+    existing = set()
+    for entry in os.listdir(directory):
+        found = re.match(r'python-(.+?)(?:\.(?:spec|dsc))?$', entry)
+        if found:
+            existing.add(canonicalize_name(found.group(1)))
+    return existing
+
+
+def generate_many(args):
+    """generate spec files for many packages concurrently.
+
+    Metadata is fetched in a thread pool, the archives are analyzed in a
+    process pool and all packages are rendered with the same template
+    environment. A failing package is reported and does not stop the others.
+
+    With --recursive the dependencies of every fetched package are fetched
+    as well, as soon as its metadata is known, until the whole dependency
+    closure is generated.
+    """
+    packages = _read_package_list(args)
+    if not packages:
+        print('no packages given')
+        sys.exit(1)
+    jobs = args.jobs or os.cpu_count() or 1
+    env = _prepare_template_env(_get_template_dirs())
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    existing = _existing_packages(args.skip_existing) if args.skip_existing else set()
+    options = {option: args[option] for option in ANALYZE_OPTIONS}
+    seen = {canonicalize_name(name) for name, _ in packages}
+    print('generating spec files for {0} packages{1}...'.format(
+        len(packages), ' and their dependencies' if args.recursive else ''))
+
+    generated = []
+    failed = []
+    sources = collections.Counter()
+
+    def finish(pkg_args, data, tarball_file):
+        _finish_generate_data(pkg_args, data, tarball_file)
+        _render(env.get_template(pkg_args.template), data, pkg_args.filename)
+        generated.append(pkg_args.name)
+        if 'metadata_source' in data:
+            sources[data['metadata_source']] += 1
+        print('generated {0}'.format(pkg_args.filename))
+
+    def fail(name, exc):
+        failed.append(name)
+        print('failed {0}: {1}'.format(name, exc))
+
+    mp_context = multiprocessing.get_context('spawn')
+    setup_py_options = _setup_py_pool_options(args)
+    # --setup-jobs bounds the setup.py workers of all analysis processes
+    setup_py_slots = mp_context.BoundedSemaphore(setup_py_options['max_workers'] or os.cpu_count() or 1)
+    with concurrent.futures.ThreadPoolExecutor(jobs) as threads, \
+            concurrent.futures.ProcessPoolExecutor(
+                jobs, mp_context=mp_context,
+                initializer=_configure_setup_py_pool,
+                initargs=(setup_py_options, setup_py_slots)) as processes:
+        fetching = {}
+
+        def submit(name, version):
+            pkg_args = _package_args(args, name, version)
+            fetching[threads.submit(_fetch_and_prepare, pkg_args)] = pkg_args
+
+        for name, version in packages:
+            submit(name, version)
+        analyzing = {}
+        while fetching:
+            done, _ = concurrent.futures.wait(
+                fetching, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                pkg_args = fetching.pop(future)
+                try:
+                    data, tarball_file, archive = future.result()
+                    if args.recursive:
+                        for name in _requirement_names(data):
+                            key = canonicalize_name(name)
+                            if key not in seen and key not in existing:
+                                seen.add(key)
+                                submit(name, None)
+                    if archive:
+                        analysis = processes.submit(_analyze_archive, pkg_args.name,
+                                                    pkg_args.version, archive, data, options)
+                        analyzing[analysis] = (pkg_args, tarball_file)
+                    else:
+                        finish(pkg_args, data, tarball_file)
+                except Exception as exc:
+                    fail(pkg_args.name, exc)
+        for future in concurrent.futures.as_completed(analyzing):
+            pkg_args, tarball_file = analyzing[future]
+            try:
+                finish(pkg_args, future.result(), tarball_file)
+            except Exception as exc:
+                fail(pkg_args.name, exc)
+
+    print('{0} of {1} packages generated'.format(len(generated), len(generated) + len(failed)))
+    if sources:
+        print('archive metadata read from: {0}'.format(
+            ', '.join('{0} {1}'.format(source, count) for source, count in sources.most_common())))
+    if failed:
+        sys.exit(1)
+
+
 def fetch_data(args):
     localfile = args.localfile or None
     local = args.local
@@ -463,7 +945,7 @@ def fetch_data(args):
     elif local:
         args.fetched_data = pypi_text_metaextract(args.name)
     else:
-        data = args.fetched_data = pypi_json(args.name, args.version)
+        data = args.fetched_data = pypi_json(args.name, args.version, cache=args.cache)
         urls = data.get('urls', [])
         if len(urls) == 0:
             print(f"unable to find a suitable release for {args.name}!")
@@ -479,8 +961,9 @@ def newest_download_url(args):
     if not hasattr(args, "fetched_data"):
         return {}
     for release in args.fetched_data['urls']:     # Check download URLs in releases
-        if release.get('packagetype') == 'sdist' and not release.get('download_url'):                      # Found the source URL we care for
-            release['download_url'] = _get_source_url(args.name, release['filename'])
+        if release.get('packagetype') == 'sdist':                               # Found the source URL we care for
+            if not release.get('download_url'):
+                release['download_url'] = _get_source_url(args.name, release['filename'])
             return release
     # No PyPI tarball release, let's see if an upstream download URL is provided:
     data = args.fetched_data['info']
@@ -507,27 +990,64 @@ def Munch(args):
         "__setattr__": d.__setitem__,
         "__getitem__": d.__getitem__,
         "__setitem__": d.__setitem__,
-        "__contains__": d.__contains__})()
+        "__contains__": d.__contains__,
+        "keys": d.keys})()
 
 
 def get_argument_parser(return_subparsers=False):
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('--version', action='version', version='%(prog)s {0}'.format(py2pack_version.version))
     parser.add_argument('--proxy', help='HTTP proxy to use')
+    parser.add_argument('--pool-size', type=int, default=py2pack.network.DEFAULT_POOL_SIZE,
+                        help='number of HTTP connections kept open per host')
+    parser.add_argument('--retries', type=int, default=py2pack.network.DEFAULT_RETRIES,
+                        help='how often failed HTTP requests are retried')
+    parser.add_argument('--timeout', type=float, default=py2pack.network.DEFAULT_TIMEOUT,
+                        help='HTTP timeout in seconds')
+    parser.add_argument('--max-per-host', type=int, default=None,
+                        help='maximum number of concurrent HTTP requests per host (default: pool size)')
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help='maximum number of HTTP requests per second and host')
+    parser.add_argument('--http-stats', action='store_true',
+                        help='print HTTP request and queue statistics when done')
+    parser.add_argument('--cache-dir', default=None, help='directory of the py2pack caches')
+    parser.add_argument('--cache-ttl', type=int, default=py2pack.cache.DEFAULT_TTL,
+                        help='seconds before cached PyPI metadata is revalidated')
+    parser.add_argument('--cache-size', type=int, default=py2pack.cache.DEFAULT_MAX_SIZE,
+                        help='maximum size of the PyPI metadata cache in bytes')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not use any py2pack cache: PyPI metadata, project lists, archive indexes, '
+                             'analysis results and build environments')
+    parser.add_argument('--build-envs', type=int, default=py2pack.buildenv.DEFAULT_MAX_ENVS,
+                        help='number of cached build environments for the build backends')
+    parser.add_argument('--wheelhouse', default=None,
+                        help='directory with wheels to install build requirements from, without network access')
+    parser.add_argument('--work-dir', default=None,
+                        help='directory where archives are extracted for the build backends, e.g. on a tmpfs')
+    parser.add_argument('--stream-archives', action='store_true',
+                        help='keep only the archive members py2pack looks at in memory, for huge archives')
+    parser.add_argument('--setup-jobs', type=int, default=None,
+                        help='number of setup.py scripts run at the same time (default: number of CPUs)')
+    parser.add_argument('--setup-timeout', type=int, default=py2pack.sandbox.DEFAULT_TIMEOUT,
+                        help='seconds before a setup.py is killed, 0 for no limit')
+    parser.add_argument('--setup-memory', type=int, default=py2pack.sandbox.DEFAULT_MEMORY,
+                        help='maximum memory of a setup.py in MiB, 0 for no limit')
     subparsers = parser.add_subparsers(title='commands')
 
     parser_list = subparsers.add_parser('list', help='list all packages on PyPI')
     parser_list.set_defaults(func=list_packages)
 
     parser_search = subparsers.add_parser('search', help='search for packages on PyPI')
-    parser_search.add_argument('name', help='package name (with optional version)')
+    parser_search.add_argument('name', help='package name, prefix, substring or misspelling')
+    parser_search.add_argument('--refresh', action='store_true', help='update the local project list first')
+    parser_search.add_argument('--limit', type=int, default=20, help='maximum number of results')
     parser_search.set_defaults(func=search)
 
     parser_show = subparsers.add_parser('show', help='show metadata for package')
     parser_show.add_argument('name', nargs='?', help='package name')
     parser_show.add_argument('version', nargs='?', help='package version (optional)')
     parser_show.add_argument('--local', action='store_true', help='get metadata from local package')
-    parser_show.add_argument('--localfile', default='', help='path to the local PKG-INFO or json metadata')
+    parser_show.add_argument('--localfile', default='', help='path to the local PKG-INFO, json metadata, sdist or wheel')
     parser_show.set_defaults(func=show)
 
     parser_fetch = subparsers.add_parser('fetch', help='download package source tarball from PyPI')
@@ -547,15 +1067,46 @@ def get_argument_parser(return_subparsers=False):
     parser_generate.add_argument('--description', default=None, help='description text')
     parser_generate.add_argument('--source-glob', help='source glob template')
     parser_generate.add_argument('--local', action='store_true', help='get metadata from local package')
-    parser_generate.add_argument('--localfile', default='', help='path to the local PKG-INFO or json metadata')
+    parser_generate.add_argument('--localfile', default='', help='path to the local PKG-INFO, json metadata, sdist or wheel')
     parser_generate.add_argument('-t', '--template', choices=file_template_list(), default=DEFAULT_TEMPLATE, help='file template')
     parser_generate.add_argument('-f', '--filename', help='spec filename (optional)')
+    source_generate = parser_generate.add_mutually_exclusive_group()
+    source_generate.add_argument('--fetch', action='store_true',
+                                 help='download the source tarball if it is not found locally')
+    source_generate.add_argument('--core-metadata', action='store_true',
+                                 help='use the metadata file published on PyPI (PEP 658) '
+                                      'if the source tarball is not found locally')
+    source_generate.add_argument('--wheel', action='store_true',
+                                 help='read the metadata from the wheels on PyPI '
+                                      'if the source tarball is not found locally')
     # TODO (toabctl): remove this is a later release
     parser_generate.add_argument(
         '-r', '--run', action='store_true',
         help='DEPRECATED and noop. will be removed in future releases!')
     parser_generate.set_defaults(func=generate)
 
+    parser_generate_many = subparsers.add_parser('generate-many', help='generate RPM spec or DEB dsc files for many packages')
+    parser_generate_many.add_argument('names', nargs='*', help='package names')
+    parser_generate_many.add_argument('-i', '--input', help='file with one package name (and optional version) per line, - for stdin')
+    parser_generate_many.add_argument('-j', '--jobs', type=int, default=None, help='number of parallel jobs (default: number of CPUs)')
+    parser_generate_many.add_argument('-d', '--output-dir', default=None, help='directory for the generated files')
+    parser_generate_many.add_argument('-r', '--recursive', action='store_true', help='also generate the dependencies, recursively')
+    parser_generate_many.add_argument('--skip-existing', metavar='DIR', default=None,
+                                      help='do not generate dependencies with a python-<name> recipe in DIR')
+    parser_generate_many.add_argument('--maintainer', default=None, help='maintainer')
+    parser_generate_many.add_argument('--source-glob', help='source glob template')
+    source_generate_many = parser_generate_many.add_mutually_exclusive_group()
+    source_generate_many.add_argument('--fetch', action='store_true',
+                                      help='download the source tarballs which are not found locally')
+    source_generate_many.add_argument('--core-metadata', action='store_true',
+                                      help='use the metadata files published on PyPI (PEP 658) '
+                                           'for source tarballs not found locally')
+    source_generate_many.add_argument('--wheel', action='store_true',
+                                      help='read the metadata from the wheels on PyPI '
+                                           'for source tarballs not found locally')
+    parser_generate_many.add_argument('-t', '--template', choices=file_template_list(), default=DEFAULT_TEMPLATE, help='file template')
+    parser_generate_many.set_defaults(func=generate_many)
+
     parser_help = subparsers.add_parser('help', help='show this help')
     parser_help.set_defaults(func=lambda args: parser.print_help())
     if return_subparsers:
@@ -567,25 +1118,40 @@ def get_argument_parser(return_subparsers=False):
 def main(args=None):
     parser, subparsers = get_argument_parser(return_subparsers=True)
     args = Munch(parser.parse_args(args or sys.argv[1:]).__dict__)
+    session = py2pack.network.configure_session(
+        pool_size=args.pool_size, retries=args.retries, timeout=args.timeout,
+        max_per_host=args.max_per_host, rate=args.rate_limit)
     # set HTTP proxy if one is provided
     if args.proxy:
-        with requests.get(args.proxy) as r:
+        with session.get(args.proxy) as r:
             if not r.ok:
                 print('the proxy \'{0}\' is not responding'.format(args.proxy))
                 sys.exit(1)
-        os.environ["HTTP_PROXY"] = args.proxy
-        os.environ["HTTPS_PROXY"] = args.proxy
+        session.proxies.update({'http': args.proxy, 'https': args.proxy})
+        # pip, the build backends, setup.py and the generate-many processes
+        # take the proxy from the environment
+        for variable in ('http_proxy', 'https_proxy', 'HTTP_PROXY', 'HTTPS_PROXY'):
+            os.environ[variable] = args.proxy
+    py2pack.sandbox.configure_pool(**_setup_py_pool_options(args))
 
     if 'func' not in args:
         sys.exit(parser.print_help())
 
+    if not args.no_cache:
+        args.cache = py2pack.cache.HTTPCache(py2pack.cache.cache_path('http', args.cache_dir),
+                                             ttl=args.cache_ttl, max_size=args.cache_size)
+
     namestr = args.func.__name__
     # Custom validation logic
     if namestr in {'generate', 'show'}:
         if not args.localfile and not args.name:
             subparsers.choices[namestr].error("The name argument is required if no --localfile is provided.")
 
-    args.func(args)
+    try:
+        args.func(args)
+    finally:
+        if args.http_stats:
+            session.scheduler.report()
 
 
 def run(*args):
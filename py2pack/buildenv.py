@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reusable isolated build environments.
+
+build.util.project_wheel_metadata creates a new virtual environment and
+installs the build requirements into it for every project. BuildEnvPool
+keeps the environments instead, keyed by a hash of the build requirements
+and the interpreter, so e.g. all projects requiring "hatchling" share one
+environment.
+
+An environment is locked exclusively while it is created or while missing
+requirements of a project are added to it, and shared while the build
+backend runs, so several processes can use the pool at the same time.
+"""
+
+import contextlib
+import fcntl
+import functools
+import hashlib
+import importlib.metadata
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import venv
+
+import build
+import pyproject_hooks
+from packaging.requirements import Requirement
+from packaging.utils import canonicalize_name
+from packaging.version import Version
+
+DEFAULT_MAX_ENVS = 8
+_MARKER = 'py2pack-requirements.txt'
+
+
+@functools.lru_cache(maxsize=None)
+def _outer_pip():
+    """whether the pip of this interpreter can install into other
+    environments, which saves installing pip into every environment"""
+    try:
+        return Version(importlib.metadata.version('pip')) >= Version('22.3')
+    except importlib.metadata.PackageNotFoundError:
+        return False
+
+
+class BuildEnv(object):
+    """A virtual environment usable as build.env.IsolatedEnv."""
+
+    def __init__(self, path):
+        self.path = path
+        self.scripts_dir = os.path.join(path, 'Scripts' if os.name == 'nt' else 'bin')
+        self.python_executable = os.path.join(self.scripts_dir, 'python')
+        self.purelib = sysconfig.get_path('purelib', vars={'base': path, 'platbase': path})
+
+    def make_extra_environ(self):
+        return {'PATH': os.pathsep.join([self.scripts_dir, os.environ.get('PATH', os.defpath)]),
+                'PYTHONPATH': ''}
+
+    def create(self):
+        venv.create(self.path, clear=True, symlinks=os.name != 'nt', with_pip=not _outer_pip())
+
+    def install(self, requirements, wheelhouse=None):
+        """pip install requirements, only from wheelhouse if given"""
+        if not requirements:
+            return
+        if _outer_pip():
+            cmd = [sys.executable, '-m', 'pip', '--python', self.python_executable]
+        else:
+            cmd = [self.python_executable, '-m', 'pip']
+        cmd += ['install', '--quiet', '--disable-pip-version-check', '--no-warn-script-location']
+        if wheelhouse:
+            cmd += ['--no-index', '--find-links', wheelhouse]
+        subprocess.run(cmd + sorted(requirements), check=True,
+                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    def missing(self, requirements):
+        """the requirements which are not satisfied in the environment"""
+        installed = {canonicalize_name(dist.metadata['Name']): dist.version
+                     for dist in importlib.metadata.distributions(path=[self.purelib])}
+        missing = []
+        for requirement in requirements:
+            req = Requirement(requirement)
+            if req.marker and not req.marker.evaluate():
+                continue
+            version = installed.get(canonicalize_name(req.name))
+            if version is None or not req.specifier.contains(version, prereleases=True):
+                missing.append(requirement)
+        return missing
+
+
+class BuildEnvPool(object):
+    """Build environments in directory, shared by all projects with the
+    same build requirements.
+
+    Args:
+        directory: where the environments are kept
+        max_envs: number of environments kept, the least recently used ones
+            are removed
+        wheelhouse: directory with wheels to install the build requirements
+            from instead of the package index, for offline use
+    """
+
+    def __init__(self, directory, max_envs=DEFAULT_MAX_ENVS, wheelhouse=None):
+        self.directory = directory
+        self.max_envs = max_envs
+        self.wheelhouse = wheelhouse
+
+    def key(self, requirements):
+        """hash of the requirements and the interpreter they are installed for"""
+        normalized = sorted(str(Requirement(requirement)) for requirement in requirements)
+        hasher = hashlib.sha256()
+        for line in [sys.implementation.cache_tag, os.path.realpath(sys.executable)] + normalized:
+            hasher.update(line.encode('utf-8') + b'\n')
+        return hasher.hexdigest()[:16]
+
+    @contextlib.contextmanager
+    def _lock(self, key, blocking=True):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, key + '.lock'), 'a') as fh:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            fcntl.flock(fh, flags)
+            yield fh
+
+    def _prepare(self, key, requirements):
+        """create the environment of key if it does not exist yet"""
+        env = BuildEnv(os.path.join(self.directory, key))
+        marker = os.path.join(env.path, _MARKER)
+        if not os.path.exists(marker):
+            env.create()
+            env.install(requirements, self.wheelhouse)
+            with open(marker, 'w') as fh:
+                fh.write('\n'.join(sorted(requirements)) + '\n')
+        os.utime(marker)
+        return env
+
+    def project_wheel_metadata(self, source_dir, runner=pyproject_hooks.quiet_subprocess_runner):
+        """Like build.util.project_wheel_metadata(source_dir, isolated=True),
+        but in a pooled environment."""
+        requirements = build.ProjectBuilder(source_dir).build_system_requires
+        key = self.key(requirements)
+        with self._lock(key) as lock:
+            env = self._prepare(key, requirements)
+            builder = build.ProjectBuilder.from_isolated_env(env, source_dir, runner=runner)
+            env.install(env.missing(builder.get_requires_for_build('wheel')), self.wheelhouse)
+            # other projects may use the environment while this one builds
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = pathlib.Path(builder.metadata_path(tmpdir))
+                metadata = importlib.metadata.PathDistribution(path).metadata
+        self.evict()
+        return metadata
+
+    def evict(self):
+        """Remove the least recently used environments beyond max_envs.
+        Environments in use are kept."""
+        envs = []
+        for entry in os.scandir(self.directory):
+            with contextlib.suppress(OSError):
+                envs.append((os.stat(os.path.join(entry.path, _MARKER)).st_mtime, entry.name))
+        for _, key in sorted(envs, reverse=True)[self.max_envs:]:
+            with contextlib.suppress(BlockingIOError), self._lock(key, blocking=False):
+                shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
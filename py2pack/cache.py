@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""On-disk caches for HTTP responses of the PyPI JSON API and other metadata
+and for the results of archive analyses.
+
+Every HTTPCache entry is a single JSON file named after the sha256 of the
+request URL. It holds the response body together with the ``ETag`` and ``Last-Modified``
+headers, so stale entries can be revalidated with a conditional request
+instead of being downloaded again.
+
+Entries are written to a temporary file and moved into place with
+``os.replace`` by atomic_write, which makes them safe to share between several concurrently
+running py2pack processes. The modification time of an entry is its last use
+and drives the LRU eviction once the cache grows beyond its size cap. Each
+HTTPCache keeps a running total of the size, so only the puts which exceed
+the cap, and every EVICT_INTERVAL-th put to account for the entries of other
+processes, scan the cache directory.
+
+ResultCache entries are content-addressed and never go stale, they are
+only evicted.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+
+import platformdirs
+
+import py2pack.network
+
+DEFAULT_TTL = 3600
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+DEFAULT_MAX_RESULTS = 4096
+
+
+def default_cache_dir():
+    return platformdirs.user_cache_dir(appname="py2pack")
+
+
+def cache_path(name, cache_dir=None):
+    """Path of the cache called name inside cache_dir or the default cache dir."""
+    return os.path.join(cache_dir or default_cache_dir(), name)
+
+
+def remove_least_recently_used(directory, suffix, keep):
+    """Remove all but the keep most recently used files ending with suffix
+    in directory. Files are marked as used by updating their mtime."""
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(suffix):
+            with contextlib.suppress(OSError):
+                entries.append((entry.stat().st_mtime, entry.path))
+    for _, path in sorted(entries, reverse=True)[keep:]:
+        with contextlib.suppress(OSError):
+            os.unlink(path)
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='wb', **kwargs):
+    """Open a temporary file next to path for writing, like open(), and
+    move it to path when the block is left without an exception. Readers,
+    also in other processes, see either the old or the complete new file.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, mode, **kwargs) as fh:
+            yield fh
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        raise
+
+
+def _matches_digest(body, sha256):
+    return not sha256 or hashlib.sha256(body).hexdigest() == sha256.lower()
+
+
+class ResultCache(object):
+    """Content-addressed store of pickled results of expensive computations.
+
+    The key must be derived from all inputs of the computation, e.g. the
+    sha256 of an archive and the py2pack version, so entries never need to
+    be revalidated. The least recently used entries beyond max_entries are
+    removed.
+    """
+
+    def __init__(self, directory, max_entries=DEFAULT_MAX_RESULTS):
+        self.directory = directory
+        self.max_entries = max_entries
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    def get(self, key):
+        """Return the result stored for key or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fh:
+                result = pickle.load(fh)
+        except (OSError, ValueError, EOFError, AttributeError, pickle.UnpicklingError):
+            return None
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return result
+
+    def put(self, key, result):
+        os.makedirs(self.directory, exist_ok=True)
+        with atomic_write(self._path(key)) as fh:
+            pickle.dump(result, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        remove_least_recently_used(self.directory, '.pickle', self.max_entries)
+
+
+class HTTPCache(object):
+    """Cache for HTTP GET responses, revalidated with ETag/Last-Modified.
+
+    Args:
+        directory: where to store the entries. Defaults to the "http"
+            subdirectory of the platformdirs user cache dir
+        ttl: seconds an entry is used without asking the server again
+        max_size: size cap in bytes, least recently used entries are
+            evicted when it is exceeded
+    """
+
+    EVICT_INTERVAL = 256
+
+    def __init__(self, directory=None, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory or cache_path("http")
+        self.ttl = ttl
+        self.max_size = max_size
+        # size of the entries as of the last scan plus the puts since then
+        self._size = None
+        self._puts = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.directory,
+                            hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    @contextlib.contextmanager
+    def _lock(self):
+        with open(os.path.join(self.directory, '.lock'), 'a') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def get(self, url):
+        """Return the cached entry for url or None.
+
+        A hit marks the entry as recently used.
+        """
+        path = self._path(url)
+        try:
+            with open(path, 'r') as fh:
+                entry = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if entry.get('url') != url:
+            return None
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return entry
+
+    def put(self, url, body, headers=None, stored=None):
+        """Store body and the validators from headers for url."""
+        headers = headers or {}
+        entry = {
+            'url': url,
+            'stored': time.time() if stored is None else stored,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'body': body,
+        }
+        path = self._path(url)
+        try:
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        with atomic_write(path, 'w') as fh:
+            json.dump(entry, fh)
+        self._puts += 1
+        if self._size is not None and self._puts % self.EVICT_INTERVAL:
+            with contextlib.suppress(OSError):
+                self._size += os.stat(path).st_size - replaced
+            if self._size <= self.max_size:
+                return entry
+        self.evict()
+        return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry.get('stored', 0) < self.ttl
+
+    def conditional_headers(self, entry):
+        """Request headers to revalidate entry."""
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def size(self):
+        return sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield path, st.st_mtime, st.st_size
+
+    def evict(self):
+        """Remove least recently used entries until the size cap is met."""
+        with self._lock():
+            entries = sorted(self._entries(), key=lambda e: e[1])
+            total = sum(size for _, _, size in entries)
+            for path, _, size in entries:
+                if total <= self.max_size:
+                    break
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(path)
+                total -= size
+            self._size = total
+
+    def clear(self):
+        with self._lock():
+            for path, _, _ in list(self._entries()):
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(path)
+            self._size = 0
+
+    def get_json(self, url):
+        """GET url and decode the JSON body, going through the cache.
+
+        Fresh entries are returned without network access, stale ones are
+        revalidated with a conditional request. Error responses are not
+        cached.
+        """
+        entry = self.get(url)
+        if entry is not None and self.is_fresh(entry):
+            return json.loads(entry['body'])
+        with py2pack.network.get(url, headers=self.conditional_headers(entry)) as r:
+            if self._not_modified(url, entry, r):
+                return json.loads(entry['body'])
+            data = r.json()
+            if r.ok:
+                self.put(url, r.text, r.headers)
+        return data
+
+    def get_text(self, url, sha256=None):
+        """GET url and return the body decoded as UTF-8, going through the
+        cache like get_json.
+
+        Args:
+            url: the URL to GET
+            sha256: hex digest the body must have, entries which do not
+                match it are neither used nor stored
+
+        Raises:
+            requests.HTTPError: for error responses
+            py2pack.network.DigestMismatch: when the body does not match
+                sha256
+        """
+        entry = self.get(url)
+        if entry is not None and not _matches_digest(entry['body'].encode('utf-8'), sha256):
+            entry = None
+        if entry is not None and self.is_fresh(entry):
+            return entry['body']
+        with py2pack.network.get(url, headers=self.conditional_headers(entry)) as r:
+            if self._not_modified(url, entry, r):
+                return entry['body']
+            r.raise_for_status()
+            if not _matches_digest(r.content, sha256):
+                raise py2pack.network.DigestMismatch("sha256 of '{}' does not match".format(url))
+            text = r.content.decode('utf-8')
+            self.put(url, text, r.headers)
+        return text
+
+    def _not_modified(self, url, entry, r):
+        """refresh entry if r confirms that it is still valid"""
+        if r.status_code != 304 or entry is None:
+            return False
+        self.put(url, entry['body'], {
+            'ETag': r.headers.get('ETag') or entry['etag'],
+            'Last-Modified': r.headers.get('Last-Modified') or entry['last_modified']})
+        return True
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Classification of the members of an archive.
+
+A FileClassifier sorts the member names of an sdist into template data
+fields like doc_files, license_files and testsuite. All its rules are
+compiled into one regular expression, so every name is classified by a
+single match, however many rules there are.
+"""
+
+import collections
+import re
+
+FILES = 'files'
+FLAG = 'flag'
+
+Rule = collections.namedtuple('Rule', ('field', 'pattern', 'kind'))
+Rule.__doc__ = """A classification rule.
+
+A FILES rule matches pattern against the path of a member below the
+toplevel directory and lists that path in field. A FLAG rule matches
+pattern against the whole member name and sets field to True. Patterns
+match at the start of the path and ignore case.
+"""
+
+CORE_RULES = (
+    Rule('doc_files', r'(?:AUTHOR|ChangeLog|CHANGES|NEWS|README)', FILES),
+    Rule('license_files', r'(?:COPYING|LICENSE)', FILES),
+    # very broad check for testsuites
+    Rule('testsuite', r'.*test', FLAG),
+)
+
+# files distributions package in their own places
+DISTRO_RULES = (
+    Rule('man_pages', r'(?:.*/)?man[1-9]?/[^/]+\.[1-9][a-z]*$', FILES),
+    # completions/ of the sdist, the share/ trees of the shells and
+    # foo.bash-completion files, not Python packages named completion
+    Rule('completion_files', r'(?:completions/[^/]+|(?:.*/)?share/(?:bash-completion|zsh|fish)/.+'
+                             r'|(?:.*/)?[^/]+\.bash-completion)$', FILES),
+    Rule('locale_files', r'(?:.*/)?locales?/.+\.(?:po|mo)$', FILES),
+    Rule('typed', r'.*/py\.typed$', FLAG),
+)
+
+DEFAULT_RULES = CORE_RULES + DISTRO_RULES
+
+
+class FileClassifier(object):
+    """Classify member names by rules.
+
+    Args:
+        rules: sequence of Rule, DEFAULT_RULES by default
+    """
+
+    def __init__(self, rules=DEFAULT_RULES):
+        self.rules = tuple(Rule(*rule) for rule in rules)
+        alternatives = []
+        for number, rule in enumerate(self.rules):
+            prefix = '[^/]*/' if rule.kind == FILES else ''
+            # an optional lookahead per rule: a match sets the group of
+            # every rule matching the name
+            alternatives.append('(?={0}(?:{1})(?P<rule{2}>))?'.format(prefix, rule.pattern, number))
+        self._regex = re.compile(''.join(alternatives), re.IGNORECASE)
+
+    def classify(self, name):
+        """Return the rules matching the member name"""
+        match = self._regex.match(name)
+        if match.lastindex is None:
+            return ()
+        return tuple(rule for rule, group in zip(self.rules, match.groups()) if group is not None)
+
+    def tag(self, name, tags):
+        """Add the member name to the fields of the rules matching it.
+
+        tags maps the fields of FILES rules to the list of their member
+        names and the fields of FLAG rules to True, so members can be
+        tagged one by one as an archive is read.
+
+        Returns:
+            the matching rules
+        """
+        rules = self.classify(name)
+        for rule in rules:
+            if rule.kind == FLAG:
+                tags[rule.field] = True
+            else:
+                tags.setdefault(rule.field, []).append(name)
+        return rules
+
+    def collect(self, names, root):
+        """Return the template data of the member names, see template_data"""
+        tags = {}
+        for name in names:
+            self.tag(name, tags)
+        return template_data(tags, root)
+
+
+def template_data(tags, root):
+    """Return the template data of the tags of FileClassifier.tag.
+
+    FILES fields only list members of the toplevel directory root, e.g.
+    "foo-1.0", compared ignoring case.
+
+    Returns:
+        dict of the tagged fields, the FILES fields list the sorted paths
+        below root
+    """
+    prefix = root.lower() + '/'
+    data = {}
+    for field, value in tags.items():
+        if value is True:
+            data[field] = True
+            continue
+        paths = sorted(name[len(prefix):] for name in set(value) if name.lower().startswith(prefix))
+        if paths:
+            data[field] = paths
+    return data
+
+
+DEFAULT_CLASSIFIER = FileClassifier()
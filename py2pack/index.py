@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local copy of the project list of the PyPI "Simple API".
+
+The project list is read with the PEP 691 JSON variant of the Simple API
+and parsed while it streams in, so the names can be printed before the
+whole document has arrived. Servers that only talk PEP 503 HTML are parsed
+the same way, line by line.
+
+The local copy remembers the ``_last-serial`` of the index. Later syncs ask
+the server for its current serial first, and only fetch the changes since
+the stored serial (via the ``changelog_since_serial`` mirroring call) instead
+of the full list.
+
+A NameIndex built from the local copy answers prefix, substring and fuzzy
+name lookups without network access.
+"""
+
+import array
+import bisect
+import codecs
+import collections
+import contextlib
+import heapq
+import html
+import json
+import os
+import pickle
+import re
+import xmlrpc.client
+
+from packaging.utils import canonicalize_name
+
+import py2pack.cache
+import py2pack.network
+
+SIMPLE_URL = 'https://pypi.org/simple/'
+XMLRPC_URL = 'https://pypi.org/pypi'
+SIMPLE_ACCEPT = 'application/vnd.pypi.simple.v1+json, text/html;q=0.1'
+SERIAL_HEADER = 'X-PyPI-Last-Serial'
+
+_chunk_size = py2pack.network.DEFAULT_CHUNK_SIZE
+_header_size = 1023
+_whitespace_re = re.compile(r'[\s,]*')
+_serial_re = re.compile(r'"_last-serial"\s*:\s*(\d+)')
+_anchor_re = re.compile(r'<a\b[^>]*>([^<]*)</a>')
+
+
+def _iter_text(response):
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')()
+    for chunk in response.iter_content(chunk_size=_chunk_size):
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+def _iter_json_array(chunks, key, prefix=None):
+    """Yield the items of the array "key" of a JSON document as they arrive.
+
+    Args:
+        chunks: iterable of text chunks of the document
+        key: name of the array
+        prefix: list that receives the document text before the array
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    marker = re.compile(r'"{}"\s*:\s*\['.format(re.escape(key)))
+    buf = ''
+    while True:
+        found = marker.search(buf)
+        if found:
+            break
+        chunk = next(chunks, None)
+        if chunk is None:
+            return
+        buf += chunk
+    if prefix is not None:
+        prefix.append(buf[:found.start()])
+    pos = found.end()
+    while True:
+        pos = _whitespace_re.match(buf, pos).end()
+        if buf.startswith(']', pos):
+            return
+        try:
+            item, pos = decoder.raw_decode(buf, pos)
+        except ValueError:
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        yield item
+
+
+def _iter_html_names(lines):
+    for line in lines:
+        for name in _anchor_re.findall(line):
+            yield html.unescape(name)
+
+
+class SimpleIndex(object):
+    """Read the project list of a Simple API index."""
+
+    def __init__(self, url=SIMPLE_URL, xmlrpc_url=XMLRPC_URL):
+        self.url = url
+        self.xmlrpc_url = xmlrpc_url
+
+    def serial(self):
+        """Current serial of the index or None if it is not announced."""
+        with py2pack.network.get_session().head(self.url, headers={'Accept': SIMPLE_ACCEPT},
+                                                allow_redirects=True) as r:
+            value = r.headers.get(SERIAL_HEADER)
+        return int(value) if value and value.isdigit() else None
+
+    @contextlib.contextmanager
+    def projects(self, headers=None):
+        """Stream the project names.
+
+        Yields:
+            (response, names) where names is a generator of the project names
+            that fills response.serial while it is consumed. names is None if
+            the server answered 304 to a conditional request.
+        """
+        headers = dict(headers or {}, Accept=SIMPLE_ACCEPT)
+        with py2pack.network.get(self.url, headers=headers, stream=True) as r:
+            if r.status_code == 304:
+                yield r, None
+                return
+            r.raise_for_status()
+            value = r.headers.get(SERIAL_HEADER)
+            r.serial = int(value) if value and value.isdigit() else None
+            yield r, self._names(r)
+
+    def _names(self, r):
+        if r.headers.get('Content-Type', '').startswith('application/vnd.pypi.simple.v1+json'):
+            prefix = []
+            for project in _iter_json_array(_iter_text(r), 'projects', prefix):
+                if r.serial is None and prefix:
+                    found = _serial_re.search(prefix.pop())
+                    r.serial = found and int(found.group(1))
+                yield project['name']
+        else:
+            yield from _iter_html_names(r.iter_lines(chunk_size=_chunk_size, decode_unicode=True))
+
+    def changelog(self, since_serial):
+        """Return the list of changes after since_serial.
+
+        The entries are (name, version, timestamp, action, serial) tuples.
+        """
+        body = xmlrpc.client.dumps((since_serial,), 'changelog_since_serial')
+        with py2pack.network.get_session().post(
+                self.xmlrpc_url, data=body.encode('utf-8'),
+                headers={'Content-Type': 'text/xml'}) as r:
+            r.raise_for_status()
+            return xmlrpc.client.loads(r.content)[0][0]
+
+
+class ProjectList(object):
+    """Local copy of the project list of a SimpleIndex.
+
+    The copy is a text file with a JSON header line (url, serial, etag)
+    followed by one project name per line, in the order of the index.
+
+    Args:
+        directory: where to keep the copy. Defaults to the "simple"
+            subdirectory of the py2pack cache dir
+        index: the SimpleIndex to sync with
+    """
+
+    def __init__(self, directory=None, index=None):
+        self.directory = directory or py2pack.cache.cache_path('simple')
+        self.index = index or SimpleIndex()
+        self.path = os.path.join(self.directory, 'projects.txt')
+
+    def meta(self):
+        """Header of the local copy or None if there is no copy."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fh:
+                meta = json.loads(fh.readline())
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get('url') == self.index.url else None
+
+    def names(self):
+        """Iterate the project names of the local copy."""
+        with open(self.path, 'r', encoding='utf-8') as fh:
+            fh.readline()
+            for line in fh:
+                yield line.rstrip('\n')
+
+    def sync(self):
+        """Bring the local copy up to date and iterate the project names.
+
+        Names are yielded while the copy is written, so the output starts
+        before the transfer is complete. The copy is only replaced once it
+        was written completely.
+        """
+        meta = self.meta()
+        if meta is None:
+            yield from self._download(None)
+            return
+        serial = self.index.serial()
+        if serial is not None and serial == meta.get('serial'):
+            yield from self.names()
+            return
+        changes = None
+        if serial is not None and meta.get('serial') is not None:
+            try:
+                changes = self.index.changelog(meta['serial'])
+            except Exception:
+                changes = None
+        if changes is None:
+            yield from self._download(meta)
+        else:
+            yield from self._apply(changes, serial)
+
+    def update(self):
+        """Bring the local copy up to date."""
+        collections.deque(self.sync(), maxlen=0)
+
+    def _download(self, meta):
+        headers = {}
+        if meta and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        with self.index.projects(headers) as (r, names):
+            if names is None:
+                yield from self.names()
+                return
+            with self._writer() as write:
+                for name in names:
+                    write(name)
+                    yield name
+                write.meta = {'url': self.index.url, 'serial': r.serial,
+                              'etag': r.headers.get('ETag')}
+
+    def _apply(self, changes, serial):
+        created = {}
+        removed = set()
+        for name, _, _, action, change_serial in changes:
+            key = canonicalize_name(name)
+            if action == 'create':
+                created[key] = name
+                removed.discard(key)
+            elif action == 'remove project':
+                removed.add(key)
+                created.pop(key, None)
+            serial = max(serial or 0, change_serial)
+        merged = heapq.merge(self.names(), sorted(created.values(), key=canonicalize_name),
+                             key=canonicalize_name)
+        previous = None
+        with self._writer() as write:
+            for name in merged:
+                key = canonicalize_name(name)
+                if key in removed or key == previous:
+                    continue
+                previous = key
+                write(name)
+                yield name
+            write.meta = {'url': self.index.url, 'serial': serial, 'etag': None}
+
+    @contextlib.contextmanager
+    def _writer(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with py2pack.cache.atomic_write(self.path, 'w', encoding='utf-8') as fh:
+            # reserve the header line, it is filled in once the serial is known
+            fh.write(' ' * _header_size + '\n')
+
+            def write(name):
+                fh.write(name + '\n')
+            write.meta = None
+            yield write
+            fh.seek(0)
+            fh.write(json.dumps(write.meta)[:_header_size])
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _edit_distance(a, b, limit):
+    """Edit distance of a and b counting transpositions as one edit, or
+    limit + 1 if it exceeds limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+class _Strings(object):
+    """Compact read-only sequence of strings stored in one joined string."""
+
+    def __init__(self, strings):
+        self.offsets = array.array('I', [0])
+        parts = []
+        for string in strings:
+            parts.append(string)
+            self.offsets.append(self.offsets[-1] + len(string))
+        self.blob = ''.join(parts)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.blob[self.offsets[i]:self.offsets[i + 1]]
+
+
+def _default_distance(key):
+    # allow more typos in longer names, short names would match too much
+    return 0 if len(key) < 4 else 1 if len(key) < 8 else 2
+
+
+class NameIndex(object):
+    """Search index over project names.
+
+    The normalized names are kept sorted, which answers prefix lookups with
+    a binary search. An inverted index from trigrams to name positions
+    narrows substring and fuzzy lookups down to a few candidates. All
+    strings and postings are stored in a few flat arrays, so a saved index
+    loads quickly.
+
+    Args:
+        names: iterable of project names
+        source: identification of the project list the index was built from
+    """
+
+    VERSION = 1
+
+    def __init__(self, names, source=None):
+        pairs = sorted((canonicalize_name(name), name) for name in names)
+        self.keys = _Strings(key for key, _ in pairs)
+        self.names = _Strings(name for _, name in pairs)
+        self.source = source
+        positions = collections.defaultdict(list)
+        for position, (key, _) in enumerate(pairs):
+            for trigram in _trigrams('^' + key + '$'):
+                positions[trigram].append(position)
+        self.postings = array.array('I')
+        self.trigrams = {}
+        for trigram, posting in positions.items():
+            self.trigrams[trigram] = (len(self.postings), len(self.postings) + len(posting))
+            self.postings.extend(posting)
+
+    @classmethod
+    def for_project_list(cls, project_list):
+        """Load the index stored next to project_list, rebuilding it if the
+        project list changed since."""
+        st = os.stat(project_list.path)
+        source = (st.st_mtime_ns, st.st_size)
+        path = os.path.join(project_list.directory, 'names.idx')
+        try:
+            with open(path, 'rb') as fh:
+                version, index = pickle.load(fh)
+            if version == cls.VERSION and index.source == source:
+                return index
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            pass
+        index = cls(project_list.names(), source)
+        index.save(path)
+        return index
+
+    def save(self, path):
+        with py2pack.cache.atomic_write(path) as fh:
+            pickle.dump((self.VERSION, self), fh, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _posting(self, trigram):
+        start, end = self.trigrams.get(trigram, (0, 0))
+        return self.postings[start:end]
+
+    def prefix(self, text):
+        """Positions of the names starting with text."""
+        key = canonicalize_name(text)
+        start = bisect.bisect_left(self.keys, key)
+        end = start
+        while end < len(self.keys) and self.keys[end].startswith(key):
+            end += 1
+        return range(start, end)
+
+    def substring(self, text):
+        """Positions of the names containing text."""
+        key = canonicalize_name(text)
+        trigrams = _trigrams(key)
+        if not trigrams:
+            return [i for i in range(len(self.keys)) if key in self.keys[i]]
+        postings = sorted((self._posting(t) for t in trigrams), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                break
+        return sorted(i for i in candidates if key in self.keys[i])
+
+    def fuzzy(self, text, max_distance=None):
+        """Positions of the names within max_distance edits of text, closest
+        first. By default the distance grows with the length of text."""
+        key = canonicalize_name(text)
+        if max_distance is None:
+            max_distance = _default_distance(key)
+        trigrams = sorted(_trigrams('^' + key + '$'), key=lambda t: len(self._posting(t)))
+        # an insertion, deletion or substitution destroys at most three
+        # trigrams and a transposition of adjacent characters, one edit in
+        # _edit_distance, at most four. So a match shares at least "needed"
+        # trigrams and one of them is among the rarest ones
+        needed = max(1, len(trigrams) - 4 * max_distance)
+        candidates = set()
+        for trigram in trigrams[:len(trigrams) - needed + 1]:
+            candidates.update(self._posting(trigram))
+        trigrams = set(trigrams)
+        hits = []
+        for position in candidates:
+            candidate = self.keys[position]
+            if abs(len(candidate) - len(key)) > max_distance or \
+                    len(trigrams.intersection(_trigrams('^' + candidate + '$'))) < needed:
+                continue
+            distance = _edit_distance(key, candidate, max_distance)
+            if distance <= max_distance:
+                hits.append((distance, candidate, position))
+        return [position for _, _, position in sorted(hits)]
+
+    def search(self, text, limit=20, max_distance=None):
+        """Project names matching text: prefix matches first, then names
+        containing text and finally names with typos."""
+        found = {}
+        for lookup in (self.prefix, self.substring,
+                       lambda t: self.fuzzy(t, max_distance)):
+            for position in lookup(text):
+                found.setdefault(position, None)
+                if len(found) >= limit:
+                    return [self.names[i] for i in found]
+        return [self.names[i] for i in found]
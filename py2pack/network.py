@@ -0,0 +1,526 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""HTTP access for everything py2pack downloads.
+
+All requests go through one pooled requests.Session per process, so
+connections to PyPI are kept alive and reused instead of paying a new
+TCP+TLS handshake for every call.
+
+The session passes every request through a Scheduler, which caps the
+number of concurrent requests and the request rate per host and pauses all
+requests to a host that answered 429 or 503 with a Retry-After header.
+"""
+
+import collections
+import email.utils
+import hashlib
+import io
+import os
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from py2pack import version as py2pack_version
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_TIMEOUT = 30
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_REMOTE_CACHE = 16 * 1024 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _retry_after(response):
+    """Seconds to wait according to the Retry-After header or None."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+class _HostState(object):
+    def __init__(self, burst):
+        self.active = 0
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.not_before = 0.0
+        self.stats = collections.Counter()
+
+
+class Scheduler(object):
+    """Admission control for the HTTP requests of all threads.
+
+    Args:
+        max_per_host: maximum number of concurrent requests per host
+        rate: maximum number of requests per second and host, or None for
+            no limit (token bucket)
+        burst: number of requests that may exceed the rate at once,
+            defaults to rate
+    """
+
+    def __init__(self, max_per_host=DEFAULT_POOL_SIZE, rate=None, burst=None):
+        self.max_per_host = max_per_host
+        self.rate = rate
+        self.burst = burst or max(1.0, rate or 1.0)
+        self._cond = threading.Condition()
+        self._hosts = {}
+
+    def _host(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = _HostState(self.burst)
+        return self._hosts[host]
+
+    def _delay(self, state, now):
+        """seconds until state admits a request, None to wait for a release"""
+        if self.rate:
+            state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+            state.updated = now
+        delay = state.not_before - now
+        if self.rate and state.tokens < 1:
+            delay = max(delay, (1 - state.tokens) / self.rate)
+        if delay > 0:
+            return delay
+        if state.active >= self.max_per_host:
+            return None
+        return 0
+
+    def acquire(self, host):
+        """Block until a request to host may be sent."""
+        started = time.monotonic()
+        with self._cond:
+            state = self._host(host)
+            while True:
+                delay = self._delay(state, time.monotonic())
+                if delay == 0:
+                    break
+                self._cond.wait(delay)
+            state.active += 1
+            if self.rate:
+                state.tokens -= 1
+            waited = time.monotonic() - started
+            state.stats['requests'] += 1
+            state.stats['wait'] += waited
+            state.stats['max_wait'] = max(state.stats['max_wait'], waited)
+            if waited > 0.001:
+                state.stats['queued'] += 1
+
+    def release(self, host):
+        with self._cond:
+            self._host(host).active -= 1
+            self._cond.notify_all()
+
+    def defer(self, host, seconds):
+        """Do not send requests to host for the next seconds."""
+        with self._cond:
+            state = self._host(host)
+            state.not_before = max(state.not_before, time.monotonic() + seconds)
+            state.stats['throttled'] += 1
+
+    def stats(self):
+        """Per host counters: requests, queued (had to wait), wait and
+        max_wait (seconds spent waiting) and throttled (429/503 answers)."""
+        with self._cond:
+            return {host: dict(state.stats) for host, state in self._hosts.items()}
+
+    def report(self, stream=None):
+        stream = stream or sys.stderr
+        for host, stats in sorted(self.stats().items()):
+            stream.write(
+                '{}: {} requests, {} queued, {:.2f}s total wait, {:.2f}s max wait, '
+                '{} throttled\n'.format(
+                    host, stats.get('requests', 0), stats.get('queued', 0), stats.get('wait', 0),
+                    stats.get('max_wait', 0), stats.get('throttled', 0)))
+
+
+class _Session(requests.Session):
+    """requests.Session with a default timeout for every request, which
+    sends all requests through a Scheduler.
+
+    Answers 429 and 503 are retried here rather than in urllib3, so the
+    Retry-After delay holds back every request to that host.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, scheduler=None,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+        super(_Session, self).__init__()
+        self.timeout = timeout
+        self.scheduler = scheduler or Scheduler()
+        self.retries = retries
+        self.backoff = backoff
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        host = urllib.parse.urlsplit(url).netloc
+        attempt = 0
+        while True:
+            self.scheduler.acquire(host)
+            try:
+                r = super(_Session, self).request(method, url, **kwargs)
+            except BaseException:
+                self.scheduler.release(host)
+                raise
+            if r.status_code not in (429, 503) or attempt >= self.retries:
+                break
+            delay = _retry_after(r)
+            self.scheduler.defer(host, self.backoff * 2 ** attempt if delay is None else delay)
+            r.close()
+            self.scheduler.release(host)
+            attempt += 1
+        if not kwargs.get('stream'):
+            self.scheduler.release(host)
+            return r
+        # streamed bodies keep their slot until the response is closed
+        close = r.close
+
+        def release_on_close():
+            nonlocal close
+            if close is not None:
+                close, _close = None, close
+                try:
+                    _close()
+                finally:
+                    self.scheduler.release(host)
+        r.close = release_on_close
+        return r
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES,
+                   backoff=DEFAULT_BACKOFF, timeout=DEFAULT_TIMEOUT, proxy=None,
+                   max_per_host=None, rate=None):
+    """Create a keep-alive session with connection pooling and retries.
+
+    Args:
+        pool_size: number of connections kept open per host
+        retries: how often failed GET requests are retried
+        backoff: backoff factor in seconds between the retries
+        timeout: default connect and read timeout in seconds
+        proxy: HTTP proxy used for http and https URLs
+        max_per_host: maximum number of concurrent requests per host,
+            defaults to pool_size
+        rate: maximum number of requests per second and host
+
+    Returns:
+        the session
+    """
+    scheduler = Scheduler(max_per_host or pool_size, rate)
+    session = _Session(timeout, scheduler, retries, backoff)
+    retry = Retry(total=retries, backoff_factor=backoff,
+                  status_forcelist=(500, 502, 504),
+                  allowed_methods=frozenset(['GET', 'HEAD']),
+                  respect_retry_after_header=False,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['User-Agent'] = 'py2pack/{}'.format(py2pack_version.version)
+    if proxy:
+        session.proxies.update({'http': proxy, 'https': proxy})
+    return session
+
+
+def configure_session(**kwargs):
+    """Replace the shared session with one created from kwargs."""
+    global _session
+    with _session_lock:
+        old, _session = _session, create_session(**kwargs)
+    if old is not None:
+        old.close()
+    return _session
+
+
+def get_session():
+    """Return the shared session, creating it with defaults if needed."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def get(url, **kwargs):
+    return get_session().get(url, **kwargs)
+
+
+class DigestMismatch(ValueError):
+    """A downloaded file does not match its expected digest."""
+
+
+def _sha256_file(filename, hasher=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    hasher = hasher or hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher
+
+
+def file_matches_digest(filename, sha256):
+    """Check if filename exists and has the given sha256 hex digest."""
+    if not sha256 or not os.path.isfile(filename):
+        return False
+    return _sha256_file(filename).hexdigest() == sha256.lower()
+
+
+class ProgressReport(object):
+    """Print download progress and throughput to a stream.
+
+    The report is only printed when the stream is a terminal, unless
+    force is set.
+    """
+
+    def __init__(self, stream=None, interval=0.5, force=False):
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.enabled = force or self.stream.isatty()
+        self.started = time.monotonic()
+        self.last = 0
+
+    def __call__(self, done, total, received, final=False):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if not final and now - self.last < self.interval:
+            return
+        self.last = now
+        rate = received / max(now - self.started, 1e-6)
+        if total:
+            status = '{:.1f}/{:.1f} MiB ({:.0%})'.format(
+                done / 2 ** 20, total / 2 ** 20, done / total)
+        else:
+            status = '{:.1f} MiB'.format(done / 2 ** 20)
+        self.stream.write('\r{} at {:.1f} MiB/s'.format(status, rate / 2 ** 20))
+        if final:
+            self.stream.write('\n')
+        self.stream.flush()
+
+
+def download(url, filename, chunk_size=DEFAULT_CHUNK_SIZE, progress=None, sha256=None):
+    """Stream url to filename without holding the body in memory.
+
+    The data is written in chunks to "<filename>.part", which is renamed to
+    filename once the download is complete. If a partial file from an
+    interrupted download exists, the download is resumed with an HTTP Range
+    request; servers ignoring the range make it start over.
+
+    If sha256 is given, the digest is computed while the data streams in and
+    checked before the rename. An existing filename with that digest is not
+    downloaded again.
+
+    Args:
+        url: the URL to download
+        filename: the final file name
+        chunk_size: size of the chunks read from the network
+        progress: callable(done, total, received, final=False) to report the
+            progress, a ProgressReport on stderr by default
+        sha256: expected hex digest of the file, e.g. from the "digests" of
+            a PyPI release url
+
+    Returns:
+        the number of bytes received from the network
+
+    Raises:
+        DigestMismatch: when the downloaded data does not match sha256. The
+            partial file is removed.
+    """
+    if file_matches_digest(filename, sha256):
+        return 0
+    partial = filename + '.part'
+    progress = progress or ProgressReport()
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+    hasher = hashlib.sha256()
+    # byte ranges refer to the encoded body, so ask for it unencoded
+    headers = {'Accept-Encoding': 'identity'}
+    if offset:
+        headers['Range'] = 'bytes={}-'.format(offset)
+    received = 0
+    with get(url, headers=headers, stream=True) as r:
+        if r.status_code == 416 and offset:
+            # the partial file already holds the complete body
+            _finish_download(partial, filename, sha256, _sha256_file(partial))
+            return received
+        r.raise_for_status()
+        if r.status_code != 206:
+            offset = 0
+        elif sha256:
+            _sha256_file(partial, hasher)
+        length = r.headers.get('Content-Length')
+        total = offset + int(length) if length and length.isdigit() else None
+        with open(partial, 'ab' if offset else 'wb') as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                if sha256:
+                    hasher.update(chunk)
+                received += len(chunk)
+                progress(offset + received, total, received)
+    progress(offset + received, total, received, final=True)
+    _finish_download(partial, filename, sha256, hasher)
+    return received
+
+
+def _finish_download(partial, filename, sha256, hasher):
+    if sha256 and hasher.hexdigest() != sha256.lower():
+        os.unlink(partial)
+        raise DigestMismatch("sha256 of '{}' is {}, expected {}".format(
+            filename, hasher.hexdigest(), sha256))
+    os.replace(partial, filename)
+
+
+class RemoteFile(io.RawIOBase):
+    """Seekable read-only file object for a URL, backed by HTTP Range requests.
+
+    Only the blocks that are read are downloaded, so zipfile.ZipFile can list
+    a remote archive and read single members by fetching the central
+    directory and those members only. The first request fetches the last
+    block, which tells the size and holds the end of the central directory.
+    Sequential reads double the number of blocks fetched per request, so
+    streaming through the file needs few requests.
+
+    If the server ignores the Range header, the whole body is kept in memory.
+
+    Args:
+        url: the URL to read
+        block_size: granularity of the requests and the cache
+        max_cache: maximum number of bytes of blocks kept in memory
+    """
+
+    def __init__(self, url, block_size=DEFAULT_CHUNK_SIZE, max_cache=DEFAULT_REMOTE_CACHE):
+        super(RemoteFile, self).__init__()
+        self.url = url
+        self.block_size = block_size
+        self.max_cache = max_cache
+        self.requests = 0
+        self.received = 0
+        self._size = None
+        self._whole = None
+        self._blocks = collections.OrderedDict()
+        self._pos = 0
+        self._next_block = None
+        self._readahead = 1
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._fetch('bytes=-{}'.format(self.block_size))
+        return self._size
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('negative seek position {}'.format(offset))
+        self._pos = offset
+        return offset
+
+    def readinto(self, b):
+        n = min(len(b), self.size - self._pos)
+        if n <= 0:
+            return 0
+        b[:n] = self._read(self._pos, self._pos + n)
+        self._pos += n
+        return n
+
+    def _read(self, start, end):
+        if self._whole is None and end - start > self.max_cache // 2:
+            # too large for the cache, read it directly
+            data = self._fetch('bytes={}-{}'.format(start, end - 1), store=False)
+            if self._whole is None:
+                return data
+        if self._whole is not None:
+            return self._whole[start:end]
+        first, last = start // self.block_size, (end - 1) // self.block_size
+        # the blocks of the range are taken before fetching the missing
+        # ones, which may evict them from a full cache
+        blocks = {i: self._block(i) for i in range(first, last + 1) if i in self._blocks}
+        missing = [i for i in range(first, last + 1) if i not in blocks]
+        if missing:
+            self._fetch_blocks(missing[0], missing[-1])
+            if self._whole is not None:
+                return self._whole[start:end]
+            blocks.update((i, self._block(i)) for i in missing)
+        data = b''.join(blocks[i] for i in range(first, last + 1))
+        offset = first * self.block_size
+        return data[start - offset:end - offset]
+
+    def _block(self, index):
+        self._blocks.move_to_end(index)
+        return self._blocks[index]
+
+    def _fetch_blocks(self, first, last):
+        if first == self._next_block:
+            self._readahead = min(self._readahead * 2, self.max_cache // self.block_size // 2 or 1)
+        else:
+            self._readahead = 1
+        last = max(last, first + self._readahead - 1)
+        last = min(last, (self._size - 1) // self.block_size)
+        self._next_block = last + 1
+        self._fetch('bytes={}-{}'.format(first * self.block_size,
+                                         min(self._size, (last + 1) * self.block_size) - 1))
+
+    def _fetch(self, byte_range, store=True):
+        headers = {'Range': byte_range, 'Accept-Encoding': 'identity'}
+        with get(self.url, headers=headers) as r:
+            r.raise_for_status()
+            self.requests += 1
+            self.received += len(r.content)
+            if r.status_code != 206:
+                self._whole = r.content
+                self._size = len(r.content)
+                return self._whole
+            found = re.match(r'bytes (\d+)-(\d+)/(\d+)', r.headers.get('Content-Range', ''))
+            if not found:
+                raise IOError("invalid Content-Range for {}".format(self.url))
+            start, total = int(found.group(1)), int(found.group(3))
+            self._size = total
+            if store:
+                self._store(start, r.content)
+            return r.content
+
+    def _store(self, start, data):
+        """split data at start into blocks, dropping an incomplete head"""
+        offset = -start % self.block_size
+        for pos in range(start + offset, start + len(data), self.block_size):
+            block = data[pos - start:pos - start + self.block_size]
+            if len(block) == self.block_size or pos + len(block) == self._size:
+                self._blocks[pos // self.block_size] = block
+                self._blocks.move_to_end(pos // self.block_size)
+        while len(self._blocks) * self.block_size > self.max_cache:
+            self._blocks.popitem(last=False)
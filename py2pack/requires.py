@@ -23,12 +23,38 @@ bring them into a form that can be directly included in a spec file.
 For further information concerning requirements (and markers), see `PEP 508
 <https://www.python.org/dev/peps/pep-0508/>`. For versions, see `PEP 440
 <https://www.python.org/dev/peps/pep-0440/>`
+
+Parsed requirements, evaluated markers and sanitized requirements are kept
+in bounded LRU caches keyed by their strings, as the same requirements come
+up again and again when generating many packages. cache_info tells how
+well they work.
 """
 
-from typing import List, Optional  # noqa: F401, pylint: disable=unused-import
+import functools
+from typing import Dict, List, Optional  # noqa: F401, pylint: disable=unused-import
 
+from packaging.markers import Marker
 from packaging.requirements import Requirement
 
+CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _parse_requirement(requirement):
+    # type: (str) -> Requirement
+    """Return the Requirement of the string requirement.
+
+    The Requirement is shared by all callers, do not modify it.
+    """
+    return Requirement(requirement)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _evaluate_marker(marker):
+    # type: (str) -> bool
+    """Evaluate the marker string on the current environment"""
+    return Marker(marker).evaluate()
+
 
 def _requirement_filter_by_marker(req):
     # type: (Requirement) -> bool
@@ -37,7 +63,7 @@ def _requirement_filter_by_marker(req):
     This function checks for a given Requirement whether its environment marker
     is satisfied on the current environment
     """
-    return req.marker.evaluate() if req.marker else True
+    return _evaluate_marker(str(req.marker)) if req.marker else True
 
 
 def _requirement_find_lowest_possible(req):
@@ -97,9 +123,32 @@ def _requirements_sanitize(req_list):
     ... ])
     ['foo >= 3.0', 'bar > 1.0']
     """
-    filtered_req_list = (
-        _requirement_find_lowest_possible(req) for req in
-        (Requirement(s.split("#", maxsplit=1)[0]) for s in req_list)
-        if _requirement_filter_by_marker(req)
-    )
-    return [" ".join(req) for req in filtered_req_list]
+    sanitized = (_requirement_sanitize(s.split("#", maxsplit=1)[0]) for s in req_list)
+    return [req for req in sanitized if req is not None]
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _requirement_sanitize(requirement):
+    # type: (str) -> Optional[str]
+    """The sanitized requirement string, None if it is not valid for this
+    platform"""
+    req = _parse_requirement(requirement)
+    if not _requirement_filter_by_marker(req):
+        return None
+    return " ".join(_requirement_find_lowest_possible(req))
+
+
+def cache_info():
+    # type: () -> Dict[str, tuple]
+    """Return the hits, misses, maxsize and currsize of the caches of
+    parsed requirements, evaluated markers and sanitized requirements."""
+    return {'requirements': _parse_requirement.cache_info(),
+            'markers': _evaluate_marker.cache_info(),
+            'sanitized': _requirement_sanitize.cache_info()}
+
+
+def cache_clear():
+    # type: () -> None
+    """Empty the caches"""
+    for cached in (_parse_requirement, _evaluate_marker, _requirement_sanitize):
+        cached.cache_clear()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run the setup.py of archives in sandboxed worker processes.
+
+metaextract.utils.from_archive executes the setup.py of a package, which
+may hang or allocate memory without bound, and changes the working
+directory of the calling process while it does. SetupPyPool runs it in a
+worker process per archive instead, each in its own session and temporary
+directory, with a limit on its address space that setup.py inherits and a
+wall-clock timeout after which the whole process group is killed.
+"""
+
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+from contextlib import suppress
+
+DEFAULT_TIMEOUT = 300
+DEFAULT_MEMORY = 4096  # MiB
+
+# executed with python -c, so the worker does not import py2pack
+_WORKER = '''
+import json, resource, sys
+memory = int(sys.argv[2])
+if memory:
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        memory = min(memory, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+from metaextract import utils
+json.dump(utils.from_archive(sys.argv[1]), sys.stdout)
+'''
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class SetupPyError(Exception):
+    """setup.py failed in the worker process"""
+
+
+class SetupPyTimeout(SetupPyError):
+    """setup.py did not finish in time and was killed"""
+
+
+class SetupPyPool(object):
+    """Runs metaextract in at most max_workers worker processes at once.
+
+    Every setup.py runs in a fresh interpreter, so nothing it changes or
+    imports outlives it. Pools in several processes, like the analysis
+    processes of generate-many, share the limit if they are given the same
+    slots, a multiprocessing.BoundedSemaphore(max_workers).
+
+    Args:
+        max_workers: number of concurrent workers, the number of CPUs by default
+        timeout: seconds before a worker is killed, None or 0 for no limit
+        memory: maximum address space of a worker in MiB, None or 0 for no limit
+        slots: semaphore bounding the workers instead of one of this pool
+    """
+
+    def __init__(self, max_workers=None, timeout=DEFAULT_TIMEOUT, memory=DEFAULT_MEMORY, slots=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout or None
+        self.memory = memory or 0
+        self._slots = slots or threading.BoundedSemaphore(self.max_workers)
+
+    def from_archive(self, archive_filename):
+        """Like metaextract.utils.from_archive(archive_filename), in a worker.
+
+        Raises SetupPyTimeout if the worker was killed after the timeout and
+        SetupPyError if it failed otherwise.
+        """
+        archive_filename = os.path.abspath(archive_filename)
+        with self._slots, tempfile.TemporaryDirectory(prefix='py2pack_setup_') as tmpdir:
+            cmd = [sys.executable, '-c', _WORKER, archive_filename, str(self.memory * 2 ** 20)]
+            proc = subprocess.Popen(cmd, cwd=tmpdir, env=dict(os.environ, TMPDIR=tmpdir),
+                                    stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, start_new_session=True)
+            try:
+                out, err = proc.communicate(timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.communicate()
+                raise SetupPyTimeout('setup.py did not finish within {} seconds'.format(self.timeout))
+            finally:
+                # setup.py may have left processes behind
+                with suppress(ProcessLookupError, PermissionError):
+                    os.killpg(proc.pid, signal.SIGKILL)
+        if proc.returncode < 0:
+            raise SetupPyError('setup.py was killed by signal {}'.format(-proc.returncode))
+        if proc.returncode:
+            lines = err.decode('utf-8', 'replace').strip().splitlines()
+            raise SetupPyError(lines[-1] if lines else 'setup.py failed')
+        return json.loads(out)
+
+
+def configure_pool(**kwargs):
+    """Replace the shared pool with one created from kwargs."""
+    global _pool
+    with _pool_lock:
+        _pool = SetupPyPool(**kwargs)
+    return _pool
+
+
+def get_pool():
+    """Return the shared pool, creating it with defaults if needed."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SetupPyPool()
+        return _pool
+
+
+def from_archive(archive_filename):
+    return get_pool().from_archive(archive_filename)
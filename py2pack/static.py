@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Static analysis of sdists.
+
+Most legacy sdists call setup() with literal arguments only or keep their
+metadata in setup.cfg. Their metadata can be read without running setup.py
+through metaextract, which needs a worker process, an extracted archive and
+the imports of setuptools. setup_metadata returns None when setup.py does
+anything which needs to be executed to know the metadata.
+
+Likewise, the metadata of other projects is known without running their
+build backend if the PKG-INFO of the sdist declares no field dynamic
+(PEP 643) or the [project] table of pyproject.toml does not (PEP 621).
+"""
+
+import ast
+import collections
+import configparser
+import importlib.metadata
+import os
+import pathlib
+from email.headerregistry import Address
+
+from packaging.requirements import Requirement
+from packaging.utils import canonicalize_name
+from packaging.version import InvalidVersion, Version
+
+from py2pack.utils import _core_metadata_data, parse_pyproject
+
+# setup() arguments which must be known to analyze the archive statically
+_REQUIRED_FIELDS = ('data_files', 'entry_points', 'extras_require', 'install_requires',
+                    'python_requires', 'setup_requires', 'scripts', 'tests_require',
+                    'classifiers', 'description', 'license', 'ext_modules')
+# metadata which is not needed for the recipe, or also known from PyPI;
+# it is left out when not given literally
+_OPTIONAL_FIELDS = ('name', 'version', 'long_description', 'url', 'download_url',
+                    'keywords', 'author', 'author_email', 'maintainer_email')
+# the setup() arguments of distutils and setuptools, or setup.cfg options,
+# which do not change the metadata; any other one, e.g. pbr=True, is handled
+# by a plugin which has to run
+_SETUP_KEYWORDS = frozenset((
+    'name', 'version', 'author', 'author_email', 'maintainer', 'maintainer_email',
+    'url', 'download_url', 'project_urls', 'license', 'license_file', 'license_files',
+    'description', 'long_description', 'long_description_content_type', 'keywords',
+    'platforms', 'classifiers', 'provides', 'requires', 'obsoletes', 'packages',
+    'package_dir', 'package_data', 'exclude_package_data', 'include_package_data',
+    'py_modules', 'namespace_packages', 'scripts', 'ext_modules', 'ext_package',
+    'libraries', 'headers', 'data_files', 'cmdclass', 'options', 'command_options',
+    'script_name', 'script_args', 'install_requires', 'extras_require',
+    'python_requires', 'setup_requires', 'tests_require', 'dependency_links',
+    'entry_points', 'zip_safe', 'eager_resources', 'test_suite', 'test_loader',
+    'use_2to3', 'convert_2to3_doctests', 'use_2to3_fixers', 'use_2to3_exclude_fixers',
+    # setuptools_scm only sets the version, which is left out when unknown
+    'use_scm_version',
+))
+# setup.cfg sections setuptools reads besides [metadata] and [options]
+_CFG_SECTIONS = ('options.extras_require', 'options.entry_points', 'options.data_files',
+                 'options.package_data', 'options.exclude_package_data', 'options.packages.find')
+# setup.cfg sections of setuptools plugins which change the metadata
+_CFG_PLUGIN_SECTIONS = ('files', 'entry_points', 'pbr', 'global', 'backwards_compat')
+# setup_requires of plugins which change the metadata, e.g. pbr reads the
+# requirements from requirements.txt and the scripts from [entry_points]
+_METADATA_PLUGINS = ('pbr', 'd2to1')
+
+# the values metaextract reports for setup() without arguments
+_DEFAULTS = {'install_requires': [], 'extras_require': {}, 'setup_requires': [],
+             'classifiers': [], 'keywords': []}
+
+# keys metaextract.utils.from_archive sorts
+_SORTED_FIELDS = ('data_files', 'entry_points', 'extras_require', 'install_requires',
+                  'setup_requires', 'scripts', 'tests_require')
+
+_CFG_ALIASES = {'home_page': 'url', 'summary': 'description', 'classifier': 'classifiers',
+                'platform': 'platforms'}
+
+# a setup() argument whose value is only known when setup.py runs
+_UNKNOWN = object()
+
+
+class _Dynamic(Exception):
+    """setup.py or setup.cfg needs to be executed"""
+
+
+def _literal(node, names):
+    """value of node, which may refer to the literal assignments in names"""
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        return [_literal(element, names) for element in node.elts]
+    if isinstance(node, ast.Dict) and None not in node.keys:
+        return {_literal(key, names): _literal(value, names)
+                for key, value in zip(node.keys, node.values)}
+    if isinstance(node, ast.Name) and node.id in names:
+        return _literal(names[node.id], names)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left, right = _literal(node.left, names), _literal(node.right, names)
+        if type(left) is not type(right) or not isinstance(left, (str, list)):
+            raise _Dynamic()
+        return left + right
+    raise _Dynamic()
+
+
+def _is_setup(node):
+    return (isinstance(node, ast.Call) and
+            (isinstance(node.func, ast.Name) and node.func.id == 'setup' or
+             isinstance(node.func, ast.Attribute) and node.func.attr == 'setup'))
+
+
+def _is_main_guard(node):
+    test = node.test
+    return (isinstance(test, ast.Compare) and isinstance(test.left, ast.Name) and
+            test.left.id == '__name__' and len(test.comparators) == 1 and
+            isinstance(test.comparators[0], ast.Constant) and
+            test.comparators[0].value == '__main__')
+
+
+def _bindings(tree, call):
+    """how often the names in tree are bound or used outside of call, e.g.
+    passed to a function which may modify them"""
+    inside = {id(node) for node in ast.walk(call)}
+    counts = collections.Counter()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and (not isinstance(node.ctx, ast.Load) or id(node) not in inside):
+            counts[node.id] += 1
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            counts.update(node.names)
+        elif isinstance(node, ast.alias):
+            counts[(node.asname or node.name).split('.')[0]] += 1
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            counts[node.name] += 1
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            counts[node.name] += 1
+    return counts
+
+
+def _toplevel(body):
+    """the statements of body and of an if __name__ == '__main__' block in it"""
+    for node in body:
+        if isinstance(node, ast.If) and _is_main_guard(node):
+            yield from node.body
+        else:
+            yield node
+
+
+def _setup_py_arguments(source):
+    """the setup() arguments in source, _UNKNOWN for the ones which are not
+    literal.
+
+    setup() has to be called once, in the toplevel code of setup.py. Names
+    in its arguments are resolved if they are assigned once, in the toplevel
+    code, and not used outside of the setup() call, so setup.py may e.g. read
+    the README for the long description, but not compute the requirements.
+    """
+    tree = ast.parse(source)
+    calls = [node for node in ast.walk(tree) if _is_setup(node)]
+    toplevel = list(_toplevel(tree.body))
+    if len(calls) != 1 or calls[0].args or not any(
+            isinstance(node, ast.Expr) and node.value is calls[0] for node in toplevel):
+        raise _Dynamic()
+    bindings = _bindings(tree, calls[0])
+    names = {node.targets[0].id: node.value for node in toplevel
+             if isinstance(node, ast.Assign) and len(node.targets) == 1 and
+             isinstance(node.targets[0], ast.Name) and bindings[node.targets[0].id] == 1}
+    arguments = {}
+    for keyword in calls[0].keywords:
+        if keyword.arg not in _SETUP_KEYWORDS:
+            raise _Dynamic()  # setup(**kwargs) or an argument of a plugin
+        value = keyword.value
+        if keyword.arg == 'ext_modules':
+            # only whether there are extension modules is of interest
+            value = names.get(value.id, value) if isinstance(value, ast.Name) else value
+            if isinstance(value, (ast.List, ast.Tuple)):
+                arguments[keyword.arg] = [None] * len(value.elts)
+                continue
+        try:
+            arguments[keyword.arg] = _literal(value, names)
+        except _Dynamic:
+            arguments[keyword.arg] = _UNKNOWN
+    return arguments
+
+
+def _parse_list(value, separator=','):
+    """like setuptools.config.setupcfg.ConfigHandler._parse_list"""
+    if isinstance(value, list):
+        return value
+    chunks = value.splitlines() if '\n' in value else value.split(separator)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+
+def _requirements(value):
+    if isinstance(value, str):
+        value = _parse_list(value, '\n')
+    return [line for line in value if not (isinstance(line, str) and line.startswith('#'))]
+
+
+def _valid_requirements(requirements):
+    """requirements, raises InvalidRequirement, a ValueError, if one of
+    them is no PEP 508 requirement, e.g. a pip option of a requirements
+    file"""
+    for requirement in requirements:
+        Requirement(requirement)
+    return requirements
+
+
+class _SetupCfg(object):
+    """setup.cfg of the archive of index, read like setuptools does"""
+
+    def __init__(self, index, name):
+        self.index = index
+        self.toplevel = os.path.dirname(name)
+        self.parser = configparser.RawConfigParser()
+        self.parser.optionxform = str
+        self.parser.read_string(index.read(name).decode('utf-8'))
+
+    def _file(self, value):
+        if not value.startswith('file:'):
+            return value
+        contents = []
+        for path in _parse_list(value[len('file:'):]):
+            try:
+                contents.append(self.index.read(os.path.normpath(
+                    os.path.join(self.toplevel, path))).decode('utf-8'))
+            except KeyError:
+                continue
+        return '\n'.join(contents)
+
+    def _requirements(self, value):
+        """like setuptools.config.setupcfg.ConfigOptionsHandler._parse_requirements_list"""
+        return _requirements(_parse_list(self._file(value), ';'))
+
+    def _section(self, section):
+        if not self.parser.has_section(section):
+            return {}
+        return {_CFG_ALIASES.get(key.replace('-', '_'), key.replace('-', '_')): value
+                for key, value in self.parser.items(section)}
+
+    def arguments(self):
+        for section in self.parser.sections():
+            if (section in _CFG_PLUGIN_SECTIONS or
+                    section.startswith('options.') and section not in _CFG_SECTIONS):
+                raise _Dynamic()
+        arguments = {}
+        for key, value in dict(self._section('metadata'), **self._section('options')).items():
+            if key not in _SETUP_KEYWORDS:
+                raise _Dynamic()
+            if value.startswith('attr:'):
+                arguments[key] = _UNKNOWN
+            elif key in ('install_requires', 'setup_requires', 'tests_require'):
+                arguments[key] = self._requirements(value)
+            elif key in ('classifiers', 'description', 'long_description', 'entry_points'):
+                arguments[key] = self._file(value)
+                if key == 'classifiers':
+                    arguments[key] = _parse_list(arguments[key])
+            elif key in ('keywords', 'scripts'):
+                arguments[key] = _parse_list(value)
+            else:
+                arguments[key] = value
+        if self.parser.has_section('options.extras_require'):
+            extras = self._section('options.extras_require')
+            arguments['extras_require'] = {extra: self._requirements(value)
+                                           for extra, value in extras.items()}
+        if self.parser.has_section('options.entry_points'):
+            entry_points = self._section('options.entry_points')
+            arguments['entry_points'] = {group: _parse_list(value)
+                                         for group, value in entry_points.items()}
+        if self.parser.has_section('options.data_files'):
+            data_files = self._section('options.data_files')
+            arguments['data_files'] = [[directory, _parse_list(value)]
+                                       for directory, value in data_files.items()]
+        return arguments
+
+
+def _normalize(arguments):
+    """setup() arguments in the form metaextract reports them"""
+    data = {}
+    for field in _REQUIRED_FIELDS + _OPTIONAL_FIELDS:
+        value = arguments.get(field, _DEFAULTS.get(field))
+        if value is _UNKNOWN and field in _REQUIRED_FIELDS:
+            raise _Dynamic()
+        if field in _OPTIONAL_FIELDS and (value is _UNKNOWN or field not in arguments):
+            continue
+        if field in ('install_requires', 'setup_requires', 'tests_require') and value is not None:
+            value = _valid_requirements(_requirements(value))
+            if field == 'setup_requires' and any(
+                    canonicalize_name(Requirement(requirement).name) in _METADATA_PLUGINS
+                    for requirement in value):
+                raise _Dynamic()
+        elif field == 'extras_require':
+            value = {extra: _valid_requirements(_requirements(requires))
+                     for extra, requires in value.items()}
+        elif field == 'keywords' and isinstance(value, str):
+            value = _parse_list(value)
+        elif field == 'ext_modules':
+            field, value = 'has_ext_modules', value and len(value) > 0
+        if field in _SORTED_FIELDS and isinstance(value, list):
+            value = sorted(value)
+        data[field] = value
+    return data
+
+
+def setup_metadata(index):
+    """Read the setup() arguments of the archive of index without running
+    setup.py.
+
+    Args:
+        index: the py2pack.utils.ArchiveIndex of an sdist
+
+    Returns:
+        dict of metadata like metaextract.utils.from_archive()['data'], or
+        None if setup.py or setup.cfg has to be executed for it
+    """
+    if 'project' in parse_pyproject(index):
+        # setuptools reads the metadata from the [project] table
+        return None
+    setup_py = index.toplevel('setup.py')
+    setup_cfg = index.toplevel('setup.cfg')
+    if setup_py is None and setup_cfg is None:
+        return None
+    try:
+        arguments = _SetupCfg(index, setup_cfg).arguments() if setup_cfg else {}
+        if setup_py:
+            # arguments of setup() take precedence over setup.cfg
+            arguments.update(_setup_py_arguments(index.read(setup_py)))
+        return _normalize(arguments)
+    except (_Dynamic, SyntaxError, ValueError, configparser.Error):
+        return None
+    except (TypeError, AttributeError):
+        # arguments of unexpected types, setuptools has to deal with them
+        return None
+
+
+class _PkgInfoDistribution(importlib.metadata.Distribution):
+    """the metadata of a PKG-INFO file, read like the METADATA of a wheel.
+    Files are located relative to root, the toplevel directory of the sdist
+    in the archive."""
+
+    def __init__(self, text, root=''):
+        self.text = text
+        self.root = root
+
+    def read_text(self, filename):
+        return self.text if filename in ('METADATA', 'PKG-INFO') else None
+
+    def locate_file(self, path):
+        return pathlib.Path(self.root, path)
+
+
+def _pkg_info_metadata(index):
+    name = index.toplevel('PKG-INFO')
+    if name is None:
+        return None
+    mdata = _PkgInfoDistribution(index.read(name).decode('utf-8'), os.path.dirname(name)).metadata
+    try:
+        if Version(mdata.get('Metadata-Version', '1.0')) < Version('2.2'):
+            return None  # the fields may have been changed by the build
+    except InvalidVersion:
+        return None
+    if mdata.get_all('Dynamic'):
+        return None
+    return _core_metadata_data(mdata)
+
+
+def _contributors(people):
+    """Author and Author-email of the PEP 621 authors or maintainers"""
+    names = [person['name'] for person in people if 'email' not in person and 'name' in person]
+    emails = [str(Address(person['name'], addr_spec=person['email'])) if 'name' in person
+              else person['email'] for person in people if 'email' in person]
+    return ', '.join(names) or None, ', '.join(emails) or None
+
+
+def _pyproject_metadata(index):
+    project = parse_pyproject(index).get('project')
+    if not project or project.get('dynamic'):
+        return None
+    license = project.get('license')
+    # most backends write neither a license file nor an SPDX expression
+    # (PEP 639) to the License field
+    license = license.get('text') if isinstance(license, dict) else None
+    readme = project.get('readme')
+    if isinstance(readme, str):
+        readme = {'file': readme}
+    if readme and 'file' in readme:
+        toplevel = os.path.dirname(index.toplevel('pyproject.toml'))
+        readme = {'text': index.read(os.path.normpath(os.path.join(toplevel, readme['file'])))
+                  .decode('utf-8')}
+    author, author_email = _contributors(project.get('authors', []))
+    maintainer, maintainer_email = _contributors(project.get('maintainers', []))
+    return {'home_page': None,
+            'name': project['name'],
+            'version': project['version'],
+            'description': readme['text'] if readme else None,
+            'summary': project.get('description'),
+            'license': license,
+            'keywords': ','.join(project.get('keywords', [])) or None,
+            'author': author,
+            'author_email': author_email,
+            'maintainer': maintainer,
+            'maintainer_email': maintainer_email,
+            'install_requires': project.get('dependencies') or None}
+
+
+def core_metadata(index):
+    """Read the core metadata of the archive of index without running its
+    build backend, like py2pack.utils.get_metadata.
+
+    Args:
+        index: the py2pack.utils.ArchiveIndex of an sdist
+
+    Returns:
+        a tuple of the metadata and the file it was taken from, "PKG-INFO"
+        or "pyproject.toml". (None, None) if the build backend has to be run.
+    """
+    try:
+        data = _pkg_info_metadata(index)
+        if data is not None:
+            return data, 'PKG-INFO'
+        data = _pyproject_metadata(index)
+        if data is not None:
+            return data, 'pyproject.toml'
+    except (KeyError, TypeError, ValueError):
+        # e.g. a required field is missing or has the wrong type
+        pass
+    return None, None
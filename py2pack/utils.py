@@ -17,15 +17,18 @@
 
 """Module containing utility functions that fit nowhere else."""
 
+import hashlib
 import os
+import pickle
 import tempfile
 import shutil
 from contextlib import contextmanager
 from build.util import project_wheel_metadata
 import pwd
 from email import parser
+import csv
 import json
-from io import StringIO
+from io import StringIO, TextIOWrapper
 from typing import List  # noqa: F401, pylint: disable=unused-import
 try:
     import tomllib as toml
@@ -36,6 +39,237 @@ import tarfile
 import zipfile
 from importlib import metadata
 from backports.entry_points_selectable import EntryPoint, EntryPoints
+from packaging.utils import InvalidWheelFilename, parse_wheel_filename
+
+import py2pack.cache
+import py2pack.classify
+import py2pack.network
+
+
+def _is_url(archive):
+    return isinstance(archive, str) and archive.startswith(('http://', 'https://'))
+
+
+@contextmanager
+def _archive_source(archive):
+    """yield what tarfile and zipfile should open for archive: the filename
+    itself or, for a URL, a py2pack.network.RemoteFile which only downloads
+    the parts that are read"""
+    if _is_url(archive):
+        with py2pack.network.RemoteFile(archive) as remote:
+            yield remote
+    else:
+        yield archive
+
+
+def _tarfile_open(source, mode='r'):
+    if hasattr(source, 'read'):
+        return tarfile.open(fileobj=source, mode=mode)
+    return tarfile.open(source, mode)
+
+
+def _iter_tar(tar_file):
+    """iterate lazily over the members of tar_file. Unlike iterating over
+    tar_file itself, the members are not collected in tar_file.members, so
+    memory does not grow with the number of members."""
+    while True:
+        member = tar_file.next()
+        if member is None:
+            return
+        del tar_file.members[:]
+        yield member
+
+
+class ArchiveIndex(object):
+    """Contents of a tar or zip archive, read in a single pass.
+
+    Holds the sorted member list, the offset and size of every member and
+    the bytes of the small toplevel files py2pack looks at (PKG-INFO,
+    pyproject.toml, setup.cfg, setup.py and the license, README and
+    requirements files). Build it once per archive and
+    pass it to the helpers of this module instead of the filename, so a
+    compressed tarball is decompressed once instead of once per helper.
+    for_archive keeps the index on disk, keyed by the sha256 of the archive,
+    so later runs on the same archive do not decompress it at all to read
+    those files or the member list.
+
+    Members are classified as they are read, tags holds the result, see
+    py2pack.classify.FileClassifier.tag. A streaming index keeps only the
+    members py2pack looks at in the member list, see _keeper, so its memory
+    does not grow with the number of members of a tarball. Other members are
+    found by reading the archive again.
+
+    Args:
+        filename: name or URL of the archive
+        streaming: whether to build a streaming index
+        classifier: py2pack.classify.FileClassifier of the members, the
+            default classifier if None
+
+    Raises:
+        ValueError: when the file is neither a zip nor a tar archive
+    """
+
+    VERSION = 5
+    CACHED_FILES = ('PKG-INFO', 'pyproject.toml', 'setup.cfg', 'setup.py')
+    # the README is the readme of pyproject.toml or a long_description and
+    # requirements files are listed with "file:" in setup.cfg
+    CACHED_PREFIXES = ('COPYING', 'LICENSE', 'README', 'REQUIREMENTS')
+    MAX_CACHED_SIZE = 1024 * 1024
+    MAX_STORED_INDEXES = 1024
+
+    def __init__(self, filename, streaming=False, classifier=None):
+        classifier = classifier or py2pack.classify.DEFAULT_CLASSIFIER
+        self.filename = filename
+        self.streaming = streaming
+        self.rules = classifier.rules
+        self.digest = None
+        self.members = {}
+        self.files = {}
+        self.tags = {}
+        with _archive_source(filename) as source:
+            if tarfile.is_tarfile(source):
+                self.kind = 'tar'
+                self._read_tar(source, self._keeper(classifier))
+            elif zipfile.is_zipfile(source):
+                self.kind = 'zip'
+                self._read_zip(source, self._keeper(classifier))
+            else:
+                raise ValueError("Can not index '{!s}'. "
+                                 "Not a tar or zip file".format(filename))
+        self.members.pop('./', None)
+        self.names = sorted(self.members)
+
+    @classmethod
+    def for_archive(cls, filename, directory=None, streaming=False, classifier=None):
+        """Load the index of filename stored in directory, or build it and
+        store it there. Without a directory the index is just built.
+
+        Indexes are stored as <sha256 of the archive>.idx, streaming ones as
+        <sha256 of the archive>-stream.idx. The least recently used ones are
+        removed when there are more than MAX_STORED_INDEXES.
+        """
+        if directory is None or _is_url(filename):
+            return cls(filename, streaming, classifier)
+        hasher = hashlib.sha256()
+        with open(filename, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+        path = os.path.join(directory, digest + ('-stream' if streaming else '') + '.idx')
+        try:
+            with open(path, 'rb') as fh:
+                version, index = pickle.load(fh)
+            rules = (classifier or py2pack.classify.DEFAULT_CLASSIFIER).rules
+            if version == cls.VERSION and index.digest == digest and index.rules == rules:
+                os.utime(path)
+                index.filename = filename
+                return index
+        except (OSError, ValueError, EOFError, AttributeError, pickle.UnpicklingError):
+            pass
+        index = cls(filename, streaming, classifier)
+        index.digest = digest
+        os.makedirs(directory, exist_ok=True)
+        index.save(path)
+        py2pack.cache.remove_least_recently_used(directory, '.idx', cls.MAX_STORED_INDEXES)
+        return index
+
+    def save(self, path):
+        with py2pack.cache.atomic_write(path) as fh:
+            pickle.dump((self.VERSION, self), fh, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _cached(self, name, size):
+        basename = os.path.basename(name)
+        return (name.count('/') == 1 and size <= self.MAX_CACHED_SIZE and
+                (basename in self.CACHED_FILES or basename.upper().startswith(self.CACHED_PREFIXES)))
+
+    def _keeper(self, classifier):
+        """Return the filter of the member names kept in the member list,
+        which also tags every member name with classifier.
+
+        A streaming index keeps the toplevel members, the first member of
+        every toplevel directory, the members listed by a FILES rule of
+        classifier and the first member matching each FLAG rule, which is
+        all py2pack looks at. Any other index keeps all members.
+        """
+        if not self.streaming:
+            def keep_all(name):
+                classifier.tag(name, self.tags)
+                return True
+            return keep_all
+        directories = set()
+
+        def keep(name):
+            flags = set(self.tags)
+            kept = False
+            for rule in classifier.tag(name, self.tags):
+                if rule.kind == py2pack.classify.FILES or rule.field not in flags:
+                    kept = True
+            parts = name.split('/', 2)
+            if len(parts) < 3:
+                return True
+            if parts[1] not in directories:
+                directories.add(parts[1])
+                kept = True
+            return kept
+        return keep
+
+    def _read_tar(self, source, keep):
+        with _tarfile_open(source) as tar_file:
+            # iterating reads the members in archive order, the data of a
+            # member right after its header is read without seeking back
+            for member in _iter_tar(tar_file):
+                if keep(member.name):
+                    self.members[member.name] = (member.offset_data, member.size)
+                if member.isfile() and self._cached(member.name, member.size):
+                    with tar_file.extractfile(member) as fh:
+                        self.files[member.name] = fh.read()
+
+    def _read_zip(self, source, keep):
+        # the zip central directory is read as a whole, a streaming index of
+        # a zip file only keeps the member list small
+        with zipfile.ZipFile(source) as zip_file:
+            for info in zip_file.infolist():
+                if keep(info.filename):
+                    self.members[info.filename] = (info.header_offset, info.file_size)
+                if not info.is_dir() and self._cached(info.filename, info.file_size):
+                    self.files[info.filename] = zip_file.read(info)
+
+    def toplevel(self, basename):
+        """name of the toplevel file basename, e.g. "foo-1.0/PKG-INFO", or None"""
+        for name in self.files:
+            if os.path.basename(name) == basename:
+                return name
+        for name in self.names:
+            if name.count('/') == 1 and os.path.basename(name) == basename:
+                return name
+        return None
+
+    def read(self, name):
+        """Return the bytes of member name.
+
+        Members a streaming index did not keep are searched in the archive.
+
+        Raises:
+            KeyError: when there is no such member
+        """
+        if name in self.files:
+            return self.files[name]
+        if name not in self.members and not self.streaming:
+            raise KeyError(name)
+        with _archive_source(self.filename) as source:
+            if self.kind == 'zip':
+                with zipfile.ZipFile(source) as zip_file:
+                    return zip_file.read(name)
+            with _tarfile_open(source) as tar_file:
+                if name in self.members:
+                    offset, size = self.members[name]
+                    tar_file.fileobj.seek(offset)
+                    return tar_file.fileobj.read(size)
+                for member in _iter_tar(tar_file):
+                    if member.name == name and member.isfile():
+                        with tar_file.extractfile(member) as fh:
+                            return fh.read()
+        raise KeyError(name)
 
 
 def _get_archive_filelist(filename):
@@ -43,7 +277,7 @@ def _get_archive_filelist(filename):
     """Extract the list of files from a tar or zip archive.
 
     Args:
-        filename: name of the archive
+        filename: name or URL of the archive or an ArchiveIndex
 
     Returns:
         Sorted list of files in the archive, excluding './'
@@ -53,16 +287,19 @@ def _get_archive_filelist(filename):
         FileNotFoundError: when the provided file does not exist (for Python 3)
         IOError: when the provided file does not exist (for Python 2)
     """
+    if isinstance(filename, ArchiveIndex):
+        return list(filename.names)
     names = []  # type: List[str]
-    if tarfile.is_tarfile(filename):
-        with tarfile.open(filename) as tar_file:
-            names = sorted(tar_file.getnames())
-    elif zipfile.is_zipfile(filename):
-        with zipfile.ZipFile(filename) as zip_file:
-            names = sorted(zip_file.namelist())
-    else:
-        raise ValueError("Can not get filenames from '{!s}'. "
-                         "Not a tar or zip file".format(filename))
+    with _archive_source(filename) as source:
+        if tarfile.is_tarfile(source):
+            with _tarfile_open(source) as tar_file:
+                names = sorted(member.name for member in _iter_tar(tar_file))
+        elif zipfile.is_zipfile(source):
+            with zipfile.ZipFile(source) as zip_file:
+                names = sorted(zip_file.namelist())
+        else:
+            raise ValueError("Can not get filenames from '{!s}'. "
+                             "Not a tar or zip file".format(filename))
     if "./" in names:
         names.remove("./")
     return names
@@ -72,29 +309,33 @@ def parse_pyproject(archive):
     """Parse the pyproject.toml in the archive and return the metadata as dict.
 
     Args:
-        archive: the filename of the archive
+        archive: the filename or URL of the archive or an ArchiveIndex
 
     Returns:
         dict of metadata. Empty if no pyproject.toml was found in the toplevel directory
     """
+    if isinstance(archive, ArchiveIndex):
+        name = archive.toplevel('pyproject.toml')
+        return toml.loads(archive.read(name).decode('utf-8')) if name else {}
     pyproject = {}
-    if tarfile.is_tarfile(archive):
-        with tarfile.open(archive) as tar_file:
-            for m in tar_file:
-                if m.name.endswith('pyproject.toml') and m.name.count("/") == 1:
-                    with tar_file.extractfile(m) as fh:
-                        pyproject = toml.load(fh)
-                    break
-    elif zipfile.is_zipfile(archive):
-        with zipfile.ZipFile(archive) as zip_file:
-            for name in zip_file.namelist():
-                if name.endswith('pyproject.toml') and name.count("/") == 1:
-                    with zip_file.open(name) as fh:
-                        pyproject = toml.load(fh)
-                    break
-    else:
-        raise ValueError("Can not extract pyproject.toml from '{!s}'. "
-                         "Not a tar or zip file".format(archive))
+    with _archive_source(archive) as source:
+        if tarfile.is_tarfile(source):
+            with _tarfile_open(source) as tar_file:
+                for m in _iter_tar(tar_file):
+                    if m.name.endswith('pyproject.toml') and m.name.count("/") == 1:
+                        with tar_file.extractfile(m) as fh:
+                            pyproject = toml.load(fh)
+                        break
+        elif zipfile.is_zipfile(source):
+            with zipfile.ZipFile(source) as zip_file:
+                for name in zip_file.namelist():
+                    if name.endswith('pyproject.toml') and name.count("/") == 1:
+                        with zip_file.open(name) as fh:
+                            pyproject = toml.load(fh)
+                        break
+        else:
+            raise ValueError("Can not extract pyproject.toml from '{!s}'. "
+                             "Not a tar or zip file".format(archive))
     return pyproject
 
 
@@ -147,55 +388,97 @@ def get_setuptools_scripts(data):
     return scripts
 
 
+# toplevel directories of an sdist which build backends do not need to get
+# the metadata
+SKIPPED_DIRECTORIES = ('benchmark', 'benchmarks', 'doc', 'docs', 'example', 'examples',
+                       'test', 'testing', 'tests')
+
+
+def _needed_for_build(name):
+    parts = name.split('/')
+    return not (len(parts) > 2 and parts[1].lower() in SKIPPED_DIRECTORIES)
+
+
 @contextmanager
-def _extract_to_tempdir(archive_filename):
-    """extract the given tarball or zipfile to a tempdir and change
-    the cwd to the new tempdir. Delete the tempdir at the end"""
+def _extract_to_tempdir(archive_filename, needed=None, work_dir=None):
+    """extract the given tarball or zipfile to a new tempdir in work_dir and
+    yield the tempdir. Delete the tempdir at the end.
+
+    Only members for which needed(name) is true are extracted, all if needed
+    is None. The cwd is not changed, so this is safe to use from threads."""
+    if isinstance(archive_filename, ArchiveIndex):
+        archive_filename = archive_filename.filename
     if not os.path.exists(archive_filename):
         raise Exception("Archive '%s' does not exist" % (archive_filename))
 
-    tempdir = tempfile.mkdtemp(prefix="py2pack_")
-    current_cwd = os.getcwd()
+    needed = needed or (lambda name: True)
+    tempdir = tempfile.mkdtemp(prefix="py2pack_", dir=work_dir)
     try:
         if tarfile.is_tarfile(archive_filename):
             with tarfile.open(archive_filename) as f:
-                f.extractall(tempdir)
+                # a generator keeps it a single pass over compressed tarballs
+                f.extractall(tempdir, members=(m for m in f if needed(m.name)))
         elif zipfile.is_zipfile(archive_filename):
             with zipfile.ZipFile(archive_filename) as f:
-                f.extractall(tempdir)
+                f.extractall(tempdir, members=[n for n in f.namelist() if needed(n)])
         else:
             raise Exception("Can not extract '%s'. "
                             "Not a tar or zip file" % archive_filename)
-        os.chdir(tempdir)
         yield tempdir
     finally:
-        os.chdir(current_cwd)
         shutil.rmtree(tempdir)
 
 
-def get_metadata(filename):
+def _project_wheel_metadata(filename, needed=None, work_dir=None, build_envs=None):
+    with _extract_to_tempdir(filename, needed, work_dir) as root_dir:
+        dir_list, *_ = os.listdir(root_dir)
+        path = os.path.join(root_dir, dir_list)
+        if build_envs is not None:
+            return build_envs.project_wheel_metadata(path)
+        return project_wheel_metadata(path, isolated=True)
+
+
+def get_metadata(filename, work_dir=None, build_envs=None):
     """
-    Extracts metadata from the archive filename
+    Extracts metadata from the archive filename or ArchiveIndex
+
+    The toplevel doc, test and example directories are not extracted for the
+    build backend. Should the build fail without them, it is retried with
+    the complete archive.
+
+    Args:
+        filename: the archive or an ArchiveIndex of it
+        work_dir: directory for the extracted files, e.g. on a tmpfs. The
+            default temporary directory if None
+        build_envs: py2pack.buildenv.BuildEnvPool to run the build backend
+            in, a new isolated environment is created if None
     """
-    data = {}
+    if all(_needed_for_build(name) for name in _get_archive_filelist(filename)):
+        mdata = _project_wheel_metadata(filename, work_dir=work_dir, build_envs=build_envs)
+    else:
+        try:
+            mdata = _project_wheel_metadata(filename, _needed_for_build, work_dir, build_envs)
+        except Exception:
+            mdata = _project_wheel_metadata(filename, work_dir=work_dir, build_envs=build_envs)
 
-    with _extract_to_tempdir(filename) as root_dir:
-        dir_list, *_ = os.listdir(root_dir)
-        path = os.path.join(root_dir, dir_list)
-        mdata = project_wheel_metadata(path, isolated=True)
-
-        data['home_page'] = mdata.get('Home-page')
-        data['name'] = mdata.get('Name')
-        data['version'] = mdata.get('Version')
-        data['description'] = mdata.get('Description')
-        data['summary'] = mdata.get('Summary')
-        data['license'] = mdata.get('License')
-        data['keywords'] = mdata.get('Keywords')
-        data['author'] = mdata.get('Author')
-        data['author_email'] = mdata.get('Author-email')
-        data['maintainer'] = mdata.get('Maintainer')
-        data['maintainer_email'] = mdata.get('Maintainer-email')
-        data['install_requires'] = mdata.get_all('Requires-Dist')
+    return _core_metadata_data(mdata)
+
+
+def _core_metadata_data(mdata):
+    """the template data of the core metadata mdata, an email.message.Message"""
+    data = {}
+    data['home_page'] = mdata.get('Home-page')
+    data['name'] = mdata.get('Name')
+    data['version'] = mdata.get('Version')
+    data['description'] = mdata.get('Description')
+    data['summary'] = mdata.get('Summary')
+    data['license'] = mdata.get('License')
+    data['keywords'] = mdata.get('Keywords')
+    data['author'] = mdata.get('Author')
+    data['author_email'] = mdata.get('Author-email')
+    data['maintainer'] = mdata.get('Maintainer')
+    data['maintainer_email'] = mdata.get('Maintainer-email')
+    data['install_requires'] = mdata.get_all('Requires-Dist')
 
     return data
 
@@ -271,21 +554,84 @@ def pypi_json_stream(json_stream):
     return js
 
 
+def read_wheel(wheel, members=('METADATA', 'entry_points.txt', 'WHEEL')):
+    """Read files of the .dist-info directory of a wheel without extracting it.
+
+    Only the central directory of the zip file and the members are read, so
+    for a URL only a few small ranges are downloaded.
+
+    Args:
+        wheel: the filename or URL of the wheel
+        members: the names of the files in the .dist-info directory
+
+    Returns:
+        dict of the decoded members found in the wheel
+
+    Raises:
+        KeyError: if the wheel has no .dist-info/METADATA
+    """
+    with _archive_source(wheel) as source:
+        with zipfile.ZipFile(source) as zip_file:
+            names = zip_file.namelist()
+            dist_info = next((name[:-len('METADATA')] for name in names
+                              if name.count('/') == 1 and name.endswith('.dist-info/METADATA')), None)
+            if dist_info is None:
+                raise KeyError('.dist-info/METADATA not found in wheel ' + wheel)
+            return {member: zip_file.read(dist_info + member).decode('utf-8')
+                    for member in members if dist_info + member in names}
+
+
+def is_wheel(archive):
+    """whether archive, a filename, URL or ArchiveIndex, is a wheel"""
+    if isinstance(archive, ArchiveIndex):
+        archive = archive.filename
+    return isinstance(archive, str) and archive.endswith('.whl')
+
+
+def wheel_is_pure(filename):
+    """whether the wheel filename is tagged for any Python implementation,
+    ABI and platform, i.e. contains no extension modules"""
+    try:
+        _, _, _, tags = parse_wheel_filename(filename)
+    except InvalidWheelFilename:
+        return False
+    return all(tag.abi == 'none' and tag.platform == 'any' for tag in tags)
+
+
+def record_has_ext_modules(record):
+    """whether the RECORD of a wheel lists extension modules"""
+    return any(row and row[0].endswith(('.so', '.pyd'))
+               for row in csv.reader(StringIO(record)))
+
+
 def _check_if_pypi_archive_file(path):
     return path.count('/') == 1 and os.path.basename(path) == 'PKG-INFO'
 
 
 def pypi_archive_file(file_path):
-    if tarfile.is_tarfile(file_path):
-        with tarfile.open(file_path, 'r') as archive:
-            for member in archive.getmembers():
-                if _check_if_pypi_archive_file(member.name):
-                    return pypi_text_stream(StringIO(archive.extractfile(member).read().decode()))
-    elif zipfile.is_zipfile(file_path):
-        with zipfile.ZipFile(file_path, 'r') as archive:
-            for member in archive.namelist():
-                if _check_if_pypi_archive_file(member):
-                    return pypi_text_stream(StringIO(archive.open(member).read().decode()))
-    else:
-        raise Exception("Can not extract '%s'. Not a tar or zip file" % file_path)
+    if is_wheel(file_path):
+        if isinstance(file_path, ArchiveIndex):
+            file_path = file_path.filename
+        return pypi_text_stream(StringIO(read_wheel(file_path, ('METADATA',))['METADATA']))
+    if isinstance(file_path, ArchiveIndex):
+        name = file_path.toplevel('PKG-INFO')
+        if name is None:
+            raise KeyError('PKG-INFO not found on archive ' + str(file_path.filename))
+        return pypi_text_stream(StringIO(file_path.read(name).decode()))
+    with _archive_source(file_path) as source:
+        if tarfile.is_tarfile(source):
+            with _tarfile_open(source, 'r') as archive:
+                # stop at PKG-INFO, it is parsed while it is decompressed
+                for member in _iter_tar(archive):
+                    if _check_if_pypi_archive_file(member.name):
+                        with archive.extractfile(member) as fh:
+                            return pypi_text_stream(TextIOWrapper(fh, encoding='utf-8'))
+        elif zipfile.is_zipfile(source):
+            with zipfile.ZipFile(source, 'r') as archive:
+                for member in archive.namelist():
+                    if _check_if_pypi_archive_file(member):
+                        with archive.open(member) as fh:
+                            return pypi_text_stream(TextIOWrapper(fh, encoding='utf-8'))
+        else:
+            raise Exception("Can not extract '%s'. Not a tar or zip file" % file_path)
     raise KeyError('PKG-INFO not found on archive ' + file_path)
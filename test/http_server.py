@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local stand-in HTTP server for tests that must not touch the network."""
+
+import http.server
+import threading
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, send_body=True):
+        self.server.requests.append((self.path, dict(self.headers)))
+        route = self.server.routes.get((self.command, self.path), self.server.routes.get(self.path))
+        if route is None:
+            status, headers, body = 404, {}, b'not found'
+        else:
+            status, headers, body = route(self) if callable(route) else route
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self._respond()
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_POST(self):
+        self.body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._respond()
+
+
+class LocalHTTPServer(object):
+    """Serve routes from a dict of path to (status, headers, body) tuples.
+
+    A route may also be a callable taking the request handler and returning
+    such a tuple. Routes keyed by (method, path) take precedence over plain
+    paths. All received requests are recorded in ``requests``.
+    """
+
+    def __init__(self, routes=None):
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.httpd.routes = routes if routes is not None else {}
+        self.httpd.requests = []
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def routes(self):
+        return self.httpd.routes
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def url(self, path='/'):
+        return 'http://127.0.0.1:{}{}'.format(self.httpd.server_port, path)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import py2pack.buildenv
+
+# an in-tree build backend without requirements, so no network is needed
+BACKEND = '''
+import os
+
+
+def prepare_metadata_for_build_wheel(metadata_directory, config_settings=None):
+    dist_info = os.path.join(metadata_directory, 'foo-1.0.dist-info')
+    os.mkdir(dist_info)
+    with open(os.path.join(dist_info, 'METADATA'), 'w') as f:
+        f.write('Metadata-Version: 2.1\\nName: foo\\nVersion: 1.0\\nRequires-Dist: bar\\n')
+    return 'foo-1.0.dist-info'
+'''
+
+PYPROJECT = '''
+[build-system]
+requires = []
+build-backend = "backend"
+backend-path = ["."]
+'''
+
+
+class Py2packBuildEnvTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='py2pack_test_')
+        self.source = os.path.join(self.tmpdir, 'foo-1.0')
+        os.mkdir(self.source)
+        with open(os.path.join(self.source, 'backend.py'), 'w') as f:
+            f.write(BACKEND)
+        with open(os.path.join(self.source, 'pyproject.toml'), 'w') as f:
+            f.write(PYPROJECT)
+        self.pool = py2pack.buildenv.BuildEnvPool(os.path.join(self.tmpdir, 'envs'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_key(self):
+        self.assertEqual(self.pool.key(['hatchling', 'hatch-vcs>=0.3']),
+                         self.pool.key(['hatch-vcs >= 0.3', 'hatchling']))
+        self.assertNotEqual(self.pool.key(['hatchling']), self.pool.key(['flit_core']))
+
+    def test_project_wheel_metadata_reuses_environment(self):
+        with mock.patch.object(py2pack.buildenv.BuildEnv, 'create',
+                               autospec=True, side_effect=py2pack.buildenv.BuildEnv.create) as create:
+            for _ in range(2):
+                metadata = self.pool.project_wheel_metadata(self.source)
+                self.assertEqual(metadata['Name'], 'foo')
+                self.assertEqual(metadata.get_all('Requires-Dist'), ['bar'])
+        self.assertEqual(create.call_count, 1)
+
+    def test_missing(self):
+        env = py2pack.buildenv.BuildEnv(os.path.join(self.tmpdir, 'env'))
+        dist_info = os.path.join(env.purelib, 'hatchling-1.5.dist-info')
+        os.makedirs(dist_info)
+        with open(os.path.join(dist_info, 'METADATA'), 'w') as f:
+            f.write('Metadata-Version: 2.1\nName: hatchling\nVersion: 1.5\n')
+        self.assertEqual(env.missing(['Hatchling>=1.0', 'hatchling>=2', 'hatch-vcs',
+                                      "pywin32; sys_platform == 'nonexistent'"]),
+                         ['hatchling>=2', 'hatch-vcs'])
+
+    def test_evict(self):
+        self.pool.max_envs = 1
+        for key, mtime in (('old', 1), ('new', 2)):
+            os.makedirs(os.path.join(self.pool.directory, key))
+            marker = os.path.join(self.pool.directory, key, py2pack.buildenv._MARKER)
+            open(marker, 'w').close()
+            os.utime(marker, (mtime, mtime))
+        self.pool.evict()
+        self.assertFalse(os.path.exists(os.path.join(self.pool.directory, 'old')))
+        self.assertTrue(os.path.exists(os.path.join(self.pool.directory, 'new')))
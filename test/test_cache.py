@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+import py2pack.cache
+import py2pack.network
+from test.http_server import LocalHTTPServer
+
+
+def _etag_route(handler):
+    if handler.headers.get('If-None-Match') == '"v1"':
+        return 304, {'ETag': '"v1"'}, b''
+    return 200, {'ETag': '"v1"', 'Content-Type': 'application/json'}, b'{"info": {"name": "foo"}}'
+
+
+class Py2packCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='py2pack_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_atomic_write(self):
+        path = os.path.join(self.tmpdir, 'entry')
+        with py2pack.cache.atomic_write(path, 'w') as fh:
+            fh.write('old')
+        with self.assertRaises(RuntimeError):
+            with py2pack.cache.atomic_write(path, 'w') as fh:
+                fh.write('new')
+                raise RuntimeError('interrupted')
+        with open(path) as fh:
+            self.assertEqual(fh.read(), 'old')
+        self.assertEqual(os.listdir(self.tmpdir), ['entry'])
+
+    def test_get_json_fresh_entry_skips_network(self):
+        cache = py2pack.cache.HTTPCache(self.tmpdir)
+        with LocalHTTPServer({'/foo/json': _etag_route}) as server:
+            url = server.url('/foo/json')
+            self.assertEqual(cache.get_json(url), {'info': {'name': 'foo'}})
+            self.assertEqual(cache.get_json(url), {'info': {'name': 'foo'}})
+        self.assertEqual(len(server.requests), 1)
+
+    def test_get_json_stale_entry_is_revalidated(self):
+        cache = py2pack.cache.HTTPCache(self.tmpdir, ttl=0)
+        with LocalHTTPServer({'/foo/json': _etag_route}) as server:
+            url = server.url('/foo/json')
+            cache.get_json(url)
+            self.assertEqual(cache.get_json(url), {'info': {'name': 'foo'}})
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(server.requests[1][1].get('If-None-Match'), '"v1"')
+
+    def test_get_json_does_not_cache_errors(self):
+        cache = py2pack.cache.HTTPCache(self.tmpdir)
+        with LocalHTTPServer({'/foo/json': (404, {}, b'{"message": "Not Found"}')}) as server:
+            url = server.url('/foo/json')
+            cache.get_json(url)
+        self.assertIsNone(cache.get(url))
+
+    def test_get_text(self):
+        cache = py2pack.cache.HTTPCache(self.tmpdir)
+        with LocalHTTPServer({'/foo.metadata': (200, {}, 'Name: f\u00f6o\n'.encode('utf-8')),
+                              '/missing': (404, {}, b'')}) as server:
+            self.assertEqual(cache.get_text(server.url('/foo.metadata')), 'Name: f\u00f6o\n')
+            self.assertEqual(cache.get_text(server.url('/foo.metadata')), 'Name: f\u00f6o\n')
+            with self.assertRaises(requests.HTTPError):
+                cache.get_text(server.url('/missing'))
+        self.assertEqual(len(server.requests), 2)
+
+    def test_get_text_digest_mismatch_is_not_cached(self):
+        cache = py2pack.cache.HTTPCache(self.tmpdir)
+        body = b'Name: foo\n'
+        with LocalHTTPServer({'/foo.metadata': (200, {}, body)}) as server:
+            url = server.url('/foo.metadata')
+            with self.assertRaises(py2pack.network.DigestMismatch):
+                cache.get_text(url, sha256='0' * 64)
+            self.assertIsNone(cache.get(url))
+            self.assertEqual(cache.get_text(url, hashlib.sha256(body).hexdigest().upper()), 'Name: foo\n')
+            # a stored body which does not match is fetched again
+            with self.assertRaises(py2pack.network.DigestMismatch):
+                cache.get_text(url, sha256='0' * 64)
+        self.assertEqual(len(server.requests), 3)
+
+    def test_evict_least_recently_used(self):
+        cache = py2pack.cache.HTTPCache(self.tmpdir, max_size=10 ** 6)
+        for url in ('a', 'b', 'c'):
+            cache.put(url, 'x' * 100)
+        past = time.time() - 100
+        os.utime(cache._path('a'), (past, past))
+        cache.get('a')
+        os.utime(cache._path('b'), (past, past))
+        cache.max_size = cache.size() - 1
+        cache.evict()
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_put_scans_when_over_size(self):
+        cache = py2pack.cache.HTTPCache(self.tmpdir, max_size=10 ** 6)
+        with mock.patch.object(cache, '_entries', wraps=cache._entries) as entries:
+            for url in range(10):
+                cache.put(str(url), 'x' * 100)
+            self.assertEqual(entries.call_count, 1)
+            cache.max_size = cache.size() + 50
+            entries.reset_mock()
+            cache.put('big', 'x' * 100)
+            self.assertEqual(entries.call_count, 1)
+        self.assertLessEqual(cache.size(), cache.max_size)
+        self.assertIsNone(cache.get('0'))
+        self.assertIsNotNone(cache.get('big'))
+
+
+class Py2packResultCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='py2pack_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_put_get(self):
+        cache = py2pack.cache.ResultCache(os.path.join(self.tmpdir, 'results'))
+        self.assertIsNone(cache.get('a' * 64))
+        cache.put('a' * 64, {'data_files': [('/usr/share', ['a'])]})
+        self.assertEqual(cache.get('a' * 64), {'data_files': [('/usr/share', ['a'])]})
+
+    def test_evict_least_recently_used(self):
+        cache = py2pack.cache.ResultCache(self.tmpdir, max_entries=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        past = time.time() - 100
+        os.utime(cache._path('a'), (past, past))
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(cache.get('c'), 3)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from ddt import ddt, data, unpack
+
+import py2pack.classify
+from py2pack.classify import FileClassifier, Rule
+
+
+@ddt
+class Py2packClassifyTestCase(unittest.TestCase):
+    @data(
+        ('foo-1.0/README.rst', ['doc_files']),
+        ('foo-1.0/changelog', ['doc_files']),
+        ('foo-1.0/LICENSES/MIT.txt', ['license_files']),
+        ('foo-1.0/docs/README.rst', []),
+        ('foo-1.0/tests/README', ['testsuite']),
+        ('pytest-foo-1.0/setup.py', ['testsuite']),
+        ('foo-1.0/doc/man/foo.1', ['man_pages']),
+        ('foo-1.0/completions/foo.zsh', ['completion_files']),
+        ('foo-1.0/share/bash-completion/completions/foo', ['completion_files']),
+        ('foo-1.0/contrib/foo.bash-completion', ['completion_files']),
+        ('foo-1.0/prompt_toolkit/completion/base.py', []),
+        ('foo-1.0/foo/completions/base.py', []),
+        ('foo-1.0/foo/locale/de/LC_MESSAGES/foo.po', ['locale_files']),
+        ('foo-1.0/src/foo/py.typed', ['typed']),
+        ('foo-1.0/foo/__init__.py', []),
+    )
+    @unpack
+    def test_classify(self, name, fields):
+        self.assertEqual([rule.field for rule in py2pack.classify.DEFAULT_CLASSIFIER.classify(name)], fields)
+
+    def test_collect(self):
+        names = ['foo-1.0/COPYING', 'foo-1.0/NEWS', 'foo-1.0/README.md', 'foo-1.0/foo/test_foo.py',
+                 'other-1.0/README']
+        self.assertEqual(py2pack.classify.DEFAULT_CLASSIFIER.collect(names, 'Foo-1.0'),
+                         {'doc_files': ['NEWS', 'README.md'], 'license_files': ['COPYING'],
+                          'testsuite': True})
+
+    def test_tag(self):
+        tags = {}
+        for name in ['foo-1.0/README', 'foo-1.0/doc/README', 'foo-1.0/tests/test_foo.py']:
+            py2pack.classify.DEFAULT_CLASSIFIER.tag(name, tags)
+        self.assertEqual(tags, {'doc_files': ['foo-1.0/README'], 'testsuite': True})
+        self.assertEqual(py2pack.classify.template_data(tags, 'foo-1.0'),
+                         {'doc_files': ['README'], 'testsuite': True})
+
+    def test_rules(self):
+        classifier = FileClassifier(py2pack.classify.CORE_RULES + (
+            Rule('desktop_files', r'.*\.desktop$', py2pack.classify.FILES),))
+        self.assertEqual(classifier.collect(['foo-1.0/data/foo.desktop', 'foo-1.0/doc/man/foo.1'], 'foo-1.0'),
+                         {'desktop_files': ['data/foo.desktop']})
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import shutil
+import tempfile
+import unittest
+import xmlrpc.client
+
+import py2pack.index
+from test.http_server import LocalHTTPServer
+
+PROJECTS = ['Django', 'flask', 'py2pack', 'requests']
+JSON_TYPE = 'application/vnd.pypi.simple.v1+json'
+
+
+def _simple_json(names, serial):
+    return json.dumps({
+        'meta': {'api-version': '1.1', '_last-serial': serial},
+        'projects': [{'name': name, '_last-serial': 1} for name in names],
+    }).encode('utf-8')
+
+
+class Py2packIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='py2pack_test_')
+        self.serial = 10
+        self.changelog = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _routes(self):
+        def simple(handler):
+            return 200, {'Content-Type': JSON_TYPE,
+                         'X-PyPI-Last-Serial': str(self.serial)}, _simple_json(PROJECTS, self.serial)
+
+        def changelog(handler):
+            params, method = xmlrpc.client.loads(handler.body)
+            self.assertEqual(method, 'changelog_since_serial')
+            entries = [c for c in self.changelog if c[4] > params[0]]
+            return 200, {'Content-Type': 'text/xml'}, xmlrpc.client.dumps(
+                (entries,), methodresponse=True, allow_none=True).encode('utf-8')
+        return {'/simple/': simple, ('POST', '/pypi'): changelog}
+
+    def _project_list(self, server):
+        index = py2pack.index.SimpleIndex(server.url('/simple/'), server.url('/pypi'))
+        return py2pack.index.ProjectList(self.tmpdir, index)
+
+    def test__iter_json_array_small_chunks(self):
+        document = _simple_json(PROJECTS, 5).decode('utf-8')
+        chunks = [document[i:i + 3] for i in range(0, len(document), 3)]
+        prefix = []
+        names = [p['name'] for p in py2pack.index._iter_json_array(chunks, 'projects', prefix)]
+        self.assertEqual(names, PROJECTS)
+        self.assertIn('"_last-serial": 5', prefix[0])
+
+    def test__iter_html_names(self):
+        lines = ['<html><body>', '<a href="/simple/foo/">foo</a>',
+                 '<a href="bar-baz/">bar&#45;baz</a>', '</body></html>']
+        self.assertEqual(list(py2pack.index._iter_html_names(lines)), ['foo', 'bar-baz'])
+
+    def test_sync_downloads_and_stores(self):
+        with LocalHTTPServer(self._routes()) as server:
+            project_list = self._project_list(server)
+            self.assertEqual(list(project_list.sync()), PROJECTS)
+        self.assertEqual(list(project_list.names()), PROJECTS)
+        self.assertEqual(project_list.meta()['serial'], 10)
+
+    def test_sync_unchanged_serial_uses_local_copy(self):
+        with LocalHTTPServer(self._routes()) as server:
+            project_list = self._project_list(server)
+            list(project_list.sync())
+            del server.requests[:]
+            self.assertEqual(list(project_list.sync()), PROJECTS)
+        self.assertEqual(len(server.requests), 1)
+
+    def test_sync_applies_changelog(self):
+        with LocalHTTPServer(self._routes()) as server:
+            project_list = self._project_list(server)
+            list(project_list.sync())
+            self.serial = 12
+            self.changelog = [['Flask', None, 0, 'remove project', 11],
+                              ['numpy', None, 0, 'create', 12],
+                              ['requests', '3.0', 0, 'new release', 12]]
+            del server.requests[:]
+            names = list(project_list.sync())
+        self.assertEqual(names, ['Django', 'numpy', 'py2pack', 'requests'])
+        self.assertEqual(project_list.meta()['serial'], 12)
+        self.assertNotIn('/simple/', [path for path, _ in server.requests[1:]])
+
+    def test__edit_distance(self):
+        self.assertEqual(py2pack.index._edit_distance('requests', 'requests', 2), 0)
+        self.assertEqual(py2pack.index._edit_distance('reqeusts', 'requests', 2), 1)
+        self.assertEqual(py2pack.index._edit_distance('reqests', 'requests', 2), 1)
+        self.assertEqual(py2pack.index._edit_distance('foo', 'requests', 2), 3)
+
+
+class Py2packNameIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = py2pack.index.NameIndex([
+            'requests', 'requests-oauthlib', 'Flask', 'Flask-SQLAlchemy',
+            'SQLAlchemy', 'zope.interface', 'py2pack', 'types-requests', 'numpy', 'Django'])
+
+    def test_prefix(self):
+        self.assertEqual([self.index.names[i] for i in self.index.prefix('flask')],
+                         ['Flask', 'Flask-SQLAlchemy'])
+
+    def test_substring(self):
+        self.assertEqual([self.index.names[i] for i in self.index.substring('sqlalchemy')],
+                         ['Flask-SQLAlchemy', 'SQLAlchemy'])
+
+    def test_fuzzy(self):
+        self.assertEqual([self.index.names[i] for i in self.index.fuzzy('zope.intreface')],
+                         ['zope.interface'])
+        self.assertEqual([self.index.names[i] for i in self.index.fuzzy('py2pakc')],
+                         ['py2pack'])
+
+    def test_fuzzy_transposition(self):
+        for text, name in (('falsk', 'Flask'), ('flsak', 'Flask'), ('nupmy', 'numpy'), ('djnago', 'Django')):
+            self.assertEqual([self.index.names[i] for i in self.index.fuzzy(text, 1)], [name])
+
+    def test_search_order(self):
+        self.assertEqual(self.index.search('requests'),
+                         ['requests', 'requests-oauthlib', 'types-requests'])
+        self.assertEqual(self.index.search('requests', limit=1), ['requests'])
+
+    def test_for_project_list_is_persisted(self):
+        tmpdir = tempfile.mkdtemp(prefix='py2pack_test_')
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        with LocalHTTPServer({'/simple/': (200, {'Content-Type': JSON_TYPE},
+                                           _simple_json(PROJECTS, 1))}) as server:
+            project_list = py2pack.index.ProjectList(
+                tmpdir, py2pack.index.SimpleIndex(server.url('/simple/')))
+            project_list.update()
+        index = py2pack.index.NameIndex.for_project_list(project_list)
+        self.assertEqual(index.search('flsk'), ['flask'])
+        loaded = py2pack.index.NameIndex.for_project_list(project_list)
+        self.assertEqual(loaded.names.blob, index.names.blob)
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+
+import py2pack.network
+from test.http_server import LocalHTTPServer
+
+BODY = bytes(range(256)) * 1000
+
+
+def _ranged(handler):
+    value = handler.headers.get('Range')
+    if value:
+        start = int(value[len('bytes='):].rstrip('-'))
+        if start >= len(BODY):
+            return 416, {}, b''
+        return 206, {'Content-Range': 'bytes {}-{}/{}'.format(start, len(BODY) - 1, len(BODY))}, BODY[start:]
+    return 200, {}, BODY
+
+
+def _range_route(body):
+    def route(handler):
+        found = re.match(r'bytes=(\d*)-(\d*)$', handler.headers.get('Range', ''))
+        if not found:
+            return 200, {}, body
+        if not found.group(1):
+            start, end = max(0, len(body) - int(found.group(2))), len(body) - 1
+        else:
+            start = int(found.group(1))
+            end = min(int(found.group(2) or len(body) - 1), len(body) - 1)
+        return 206, {'Content-Range': 'bytes {}-{}/{}'.format(start, end, len(body))}, body[start:end + 1]
+    return route
+
+
+def _zip_body():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zip_file:
+        zip_file.writestr('foo-1.0/big.bin', os.urandom(2 ** 20))
+        zip_file.writestr('foo-1.0/PKG-INFO', 'Name: foo\n')
+    return buf.getvalue()
+
+
+class Py2packNetworkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='py2pack_test_')
+        self.filename = os.path.join(self.tmpdir, 'foo-1.0.tar.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_get_session_is_shared(self):
+        self.assertIs(py2pack.network.get_session(), py2pack.network.get_session())
+
+    def test_create_session_proxy(self):
+        session = py2pack.network.create_session(proxy='http://proxy:3128')
+        self.assertEqual(session.proxies, {'http': 'http://proxy:3128',
+                                           'https': 'http://proxy:3128'})
+
+    def test_create_session_retries(self):
+        attempts = []
+
+        def flaky(handler):
+            attempts.append(handler.path)
+            if len(attempts) < 3:
+                return 503, {}, b'busy'
+            return 200, {}, b'ok'
+
+        session = py2pack.network.create_session(retries=3, backoff=0)
+        with LocalHTTPServer({'/flaky': flaky}) as server:
+            with session.get(server.url('/flaky')) as r:
+                self.assertEqual(r.text, 'ok')
+        self.assertEqual(len(attempts), 3)
+
+    def test_create_session_keeps_connection_alive(self):
+        clients = set()
+
+        def record(handler):
+            clients.add(handler.client_address)
+            return 200, {}, b'ok'
+
+        session = py2pack.network.create_session()
+        with LocalHTTPServer({'/': record}) as server:
+            for _ in range(3):
+                with session.get(server.url('/')) as r:
+                    r.content
+        self.assertEqual(len(clients), 1)
+
+    def test_download(self):
+        with LocalHTTPServer({'/foo.tar.gz': _ranged}) as server:
+            received = py2pack.network.download(server.url('/foo.tar.gz'), self.filename,
+                                                chunk_size=1000)
+        self.assertEqual(received, len(BODY))
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(f.read(), BODY)
+        self.assertFalse(os.path.exists(self.filename + '.part'))
+        self.assertNotIn('Range', server.requests[0][1])
+
+    def test_download_resumes_partial_file(self):
+        with open(self.filename + '.part', 'wb') as f:
+            f.write(BODY[:1234])
+        with LocalHTTPServer({'/foo.tar.gz': _ranged}) as server:
+            received = py2pack.network.download(server.url('/foo.tar.gz'), self.filename)
+        self.assertEqual(received, len(BODY) - 1234)
+        self.assertEqual(server.requests[0][1]['Range'], 'bytes=1234-')
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(f.read(), BODY)
+
+    def test_download_restarts_without_range_support(self):
+        with open(self.filename + '.part', 'wb') as f:
+            f.write(b'garbage')
+        with LocalHTTPServer({'/foo.tar.gz': (200, {}, BODY)}) as server:
+            py2pack.network.download(server.url('/foo.tar.gz'), self.filename)
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(f.read(), BODY)
+
+    def test_download_verifies_digest(self):
+        sha256 = hashlib.sha256(BODY).hexdigest()
+        with open(self.filename + '.part', 'wb') as f:
+            f.write(BODY[:1000])
+        with LocalHTTPServer({'/foo.tar.gz': _ranged}) as server:
+            py2pack.network.download(server.url('/foo.tar.gz'), self.filename, sha256=sha256)
+        self.assertTrue(py2pack.network.file_matches_digest(self.filename, sha256))
+
+    def test_download_digest_mismatch(self):
+        with LocalHTTPServer({'/foo.tar.gz': _ranged}) as server:
+            with self.assertRaises(py2pack.network.DigestMismatch):
+                py2pack.network.download(server.url('/foo.tar.gz'), self.filename,
+                                         sha256='0' * 64)
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertFalse(os.path.exists(self.filename + '.part'))
+
+    def test_download_skips_matching_file(self):
+        with open(self.filename, 'wb') as f:
+            f.write(BODY)
+        with LocalHTTPServer({'/foo.tar.gz': _ranged}) as server:
+            received = py2pack.network.download(server.url('/foo.tar.gz'), self.filename,
+                                                sha256=hashlib.sha256(BODY).hexdigest())
+        self.assertEqual(received, 0)
+        self.assertEqual(server.requests, [])
+
+    def test_progress_report(self):
+        stream = io.StringIO()
+        report = py2pack.network.ProgressReport(stream, force=True)
+        report(2 ** 20, 2 ** 21, 2 ** 20, final=True)
+        self.assertIn('1.0/2.0 MiB (50%)', stream.getvalue())
+
+
+class Py2packRemoteFileTestCase(unittest.TestCase):
+    def test_zip_member_reads_only_needed_blocks(self):
+        body = _zip_body()
+        with LocalHTTPServer({'/foo.zip': _range_route(body)}) as server:
+            with py2pack.network.RemoteFile(server.url('/foo.zip'), block_size=4096) as remote:
+                with zipfile.ZipFile(remote) as zip_file:
+                    self.assertEqual(zip_file.read('foo-1.0/PKG-INFO'), b'Name: foo\n')
+        self.assertEqual(remote.size, len(body))
+        self.assertLess(remote.received, 4 * 4096)
+        self.assertLessEqual(remote.requests, 2)
+
+    def test_sequential_reads_grow_requests(self):
+        with LocalHTTPServer({'/foo': _range_route(BODY)}) as server:
+            with py2pack.network.RemoteFile(server.url('/foo'), block_size=1024) as remote:
+                data = b''.join(iter(lambda: remote.read(1000), b''))
+        self.assertEqual(data, BODY)
+        self.assertLess(remote.requests, 15)
+
+    def test_seek_and_read(self):
+        with LocalHTTPServer({'/foo': _range_route(BODY)}) as server:
+            with py2pack.network.RemoteFile(server.url('/foo'), block_size=1000) as remote:
+                remote.seek(-10, os.SEEK_END)
+                self.assertEqual(remote.read(), BODY[-10:])
+                remote.seek(2500)
+                self.assertEqual(remote.read(3000), BODY[2500:5500])
+                self.assertEqual(remote.tell(), 5500)
+
+    def test_small_cache_evicts_other_blocks(self):
+        with LocalHTTPServer({'/foo': _range_route(BODY[:64])}) as server:
+            with py2pack.network.RemoteFile(server.url('/foo'), block_size=4, max_cache=16) as remote:
+                for position in (32, 0, 16, 48):
+                    remote.seek(position)
+                    self.assertEqual(remote.read(4), BODY[position:position + 4])
+                remote.seek(35)
+                self.assertEqual(remote.read(2), BODY[35:37])
+                remote.seek(30)
+                self.assertEqual(remote.read(8), BODY[30:38])
+                self.assertLessEqual(len(remote._blocks) * 4, 16)
+
+    def test_without_range_support(self):
+        with LocalHTTPServer({'/foo': (200, {}, BODY)}) as server:
+            with py2pack.network.RemoteFile(server.url('/foo')) as remote:
+                remote.seek(1000)
+                self.assertEqual(remote.read(10), BODY[1000:1010])
+                self.assertEqual(remote.read(10), BODY[1010:1020])
+        self.assertEqual(remote.requests, 1)
+
+
+class Py2packSchedulerTestCase(unittest.TestCase):
+    def test_max_per_host(self):
+        lock = threading.Lock()
+        active = [0, 0]
+
+        def slow(handler):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.1)
+            with lock:
+                active[0] -= 1
+            return 200, {}, b'ok'
+
+        session = py2pack.network.create_session(max_per_host=2)
+        with LocalHTTPServer({'/': slow}) as server:
+            threads = [threading.Thread(target=lambda: session.get(server.url('/')).close())
+                       for _ in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(active[1], 2)
+        stats = session.scheduler.stats()['127.0.0.1:{}'.format(server.httpd.server_port)]
+        self.assertEqual(stats['requests'], 6)
+        self.assertGreaterEqual(stats['queued'], 3)
+        self.assertGreater(stats['max_wait'], 0.05)
+
+    def test_retry_after(self):
+        answers = [(429, {'Retry-After': '1'}, b'slow down'), (200, {}, b'ok')]
+        times = []
+
+        def throttled(handler):
+            times.append(time.monotonic())
+            return answers.pop(0)
+
+        session = py2pack.network.create_session()
+        with LocalHTTPServer({'/': throttled}) as server:
+            with session.get(server.url('/')) as r:
+                self.assertEqual(r.text, 'ok')
+        self.assertGreaterEqual(times[1] - times[0], 1)
+        stats = session.scheduler.stats()['127.0.0.1:{}'.format(server.httpd.server_port)]
+        self.assertEqual(stats['throttled'], 1)
+
+    def test_rate_limit(self):
+        scheduler = py2pack.network.Scheduler(rate=20, burst=1)
+        started = time.monotonic()
+        for _ in range(5):
+            scheduler.acquire('host')
+            scheduler.release('host')
+        self.assertGreaterEqual(time.monotonic() - started, 0.19)
+        self.assertEqual(scheduler.stats()['host']['queued'], 4)
+
+    def test_streamed_response_holds_slot(self):
+        session = py2pack.network.create_session(max_per_host=1)
+        with LocalHTTPServer({'/': (200, {}, b'ok')}) as server:
+            host = '127.0.0.1:{}'.format(server.httpd.server_port)
+            with session.get(server.url('/'), stream=True):
+                self.assertEqual(session.scheduler._host(host).active, 1)
+            self.assertEqual(session.scheduler._host(host).active, 0)
@@ -16,12 +16,34 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import io
 import os
+import shutil
+import tarfile
+import tempfile
 import unittest
+import warnings
+import zipfile
+from unittest import mock
 from ddt import ddt, data, unpack
+from packaging.utils import canonicalize_name
 
 import py2pack
+import py2pack.cache
+import py2pack.network
 from py2pack import replace_string, Munch
+from test.http_server import LocalHTTPServer
+
+
+def _sdist_url(project, url=None):
+    filename = project + '-1.0.tar.gz'
+    return {'packagetype': 'sdist', 'filename': filename,
+            'url': url or 'https://example.org/' + filename, 'download_url': url}
+
+
+def _wheel_url(filename, server):
+    return {'packagetype': 'bdist_wheel', 'filename': filename, 'url': server.url('/' + filename)}
 
 
 @ddt
@@ -57,6 +79,276 @@ class Py2packTestCase(unittest.TestCase):
     def test_show(self):
         py2pack.run('show', *self.args)
 
+    def test_proxy_is_exported(self):
+        self.addCleanup(py2pack.network.configure_session)
+        with LocalHTTPServer({'/': (200, {}, b'')}) as server, \
+                mock.patch.dict(os.environ), mock.patch('sys.stdout', io.StringIO()):
+            self.assertEqual(py2pack.run('--proxy', server.url('/'), 'help'), 0)
+            self.assertEqual(os.environ['https_proxy'], server.url('/'))
+            self.assertEqual(os.environ['HTTP_PROXY'], server.url('/'))
+            self.assertEqual(py2pack.network.get_session().proxies['https'], server.url('/'))
+
+    def _tmpdir(self):
+        tmpdir = tempfile.mkdtemp(prefix='py2pack_test_')
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        return tmpdir
+
+    def _chdir(self, directory):
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory)
+
+    def _mock_pypi_json(self, urls, **info):
+        """Patch py2pack.pypi_json to return version 1.0 of any project.
+
+        urls(project) is the list of its files, info updates its metadata.
+        The projects asked for are appended to self.fetched.
+        """
+        self.fetched = []
+
+        def pypi_json(project, release=None, cache=None):
+            self.fetched.append(project)
+            release_info = {'name': project, 'version': '1.0', 'summary': 'Summary'}
+            release_info.update({key: value(project) if callable(value) else value
+                                 for key, value in info.items()})
+            return {'info': release_info, 'urls': urls(project)}
+
+        patcher = mock.patch('py2pack.pypi_json', pypi_json)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test__read_package_list(self):
+        input_file = os.path.join(self._tmpdir(), 'packages.txt')
+        with open(input_file, 'w') as f:
+            f.write('# comment\nfoo\n\nbar 1.0\nbaz==2.0  # pinned\n')
+        args = Munch({'names': ['py2pack'], 'input': input_file})
+        self.assertEqual(py2pack._read_package_list(args),
+                         [('py2pack', None), ('foo', None), ('bar', '1.0'), ('baz', '2.0')])
+
+    def test_generate_many(self):
+        tmpdir = self._tmpdir()
+
+        def urls(project):
+            if project == 'broken':
+                raise ValueError('broken metadata')
+            return [_sdist_url(project)]
+
+        self._mock_pypi_json(urls, license='MIT', description='Description',
+                             home_page='https://example.org')
+        code = py2pack.run('--cache-dir', os.path.join(tmpdir, 'cache'), 'generate-many',
+                           'foo', 'broken', 'bar', '-j', '2', '-d', os.path.join(tmpdir, 'specs'),
+                           '-t', 'opensuse.spec', '--maintainer', 'tester')
+        self.assertEqual(code, 1)
+        self.assertEqual(sorted(os.listdir(os.path.join(tmpdir, 'specs'))),
+                         ['python-bar.spec', 'python-foo.spec'])
+        with open(os.path.join(tmpdir, 'specs', 'python-foo.spec')) as f:
+            self.assertIn('Name:           python-foo', f.read())
+
+    def test_generate_many_analyzes_archives(self):
+        tmpdir = self._tmpdir()
+        self._chdir(tmpdir)
+        setup_py = os.path.join(tmpdir, 'setup.py')
+        with open(setup_py, 'w') as f:
+            f.write("from setuptools import setup\nsetup(name='foo', install_requires=['bar>=2.0'])\n")
+        with tarfile.open('foo-1.0.tar.gz', 'w:gz') as tar:
+            tar.add(setup_py, 'foo-1.0/setup.py')
+        self._mock_pypi_json(lambda project: [_sdist_url(project)])
+
+        output = io.StringIO()
+        with mock.patch('sys.stdout', output):
+            # the archive is analyzed in a process of the process pool
+            code = py2pack.run('--no-cache', 'generate-many', 'foo', '-d', 'specs', '-t', 'opensuse.spec')
+        self.assertEqual(code, 0)
+        self.assertIn('archive metadata read from: setup.py 1', output.getvalue())
+        with open(os.path.join('specs', 'python-foo.spec')) as f:
+            self.assertIn('Requires:       python-bar >= 2.0', f.read())
+
+    def test_generate_fetch(self):
+        self._chdir(self._tmpdir())
+        analyzed = []
+
+        def augment(args, filename, data):
+            with open(filename, 'rb') as f:
+                analyzed.append((filename, f.read()))
+            data['doc_files'] = ['README']
+
+        with LocalHTTPServer({'/foo-1.0.tar.gz': (200, {}, b'sdist')}) as server:
+            self._mock_pypi_json(lambda project: [_sdist_url(project, server.url('/foo-1.0.tar.gz'))])
+            with mock.patch('py2pack._augment_data_from_tarball', augment):
+                code = py2pack.run('--no-cache', 'generate', 'foo', '--fetch', '-t', 'opensuse.spec')
+        self.assertEqual(code, 0)
+        self.assertEqual(analyzed, [('foo-1.0.tar.gz', b'sdist')])
+        with open('python-foo.spec') as f:
+            self.assertIn('%doc README', f.read())
+
+    def test_generate_fetch_local_archive(self):
+        self._chdir(self._tmpdir())
+        for filename in ('foo-1.0.tar.gz.part', 'foo-1.0.zip'):
+            with open(filename, 'wb') as f:
+                f.write(b'local')
+        analyzed = []
+
+        def augment(args, filename, data):
+            analyzed.append(filename)
+
+        with LocalHTTPServer({'/foo-1.0.tar.gz': (200, {}, b'sdist')}) as server:
+            self._mock_pypi_json(lambda project: [_sdist_url(project, server.url('/foo-1.0.tar.gz'))])
+            with mock.patch('py2pack._augment_data_from_tarball', augment):
+                code = py2pack.run('--no-cache', 'generate', 'foo', '--fetch', '-t', 'opensuse.spec')
+        self.assertEqual(code, 0)
+        self.assertEqual(analyzed, ['foo-1.0.zip'])
+        self.assertEqual(server.requests, [])
+        self.assertFalse(os.path.exists('foo-1.0.tar.gz'))
+
+    def test_generate_core_metadata(self):
+        tmpdir = self._tmpdir()
+        metadata = (b'Metadata-Version: 2.1\nName: foo\nVersion: 1.0\n'
+                    b'Requires-Dist: bar>=2.0\n'
+                    b'Requires-Dist: baz; extra == "test"\n')
+        routes = {'/foo-1.0-py3-none-any.whl.metadata': (200, {}, metadata)}
+
+        with LocalHTTPServer(routes) as server:
+            self._mock_pypi_json(lambda project: [
+                dict(_sdist_url(project, server.url('/foo-1.0.tar.gz')), **{'core-metadata': False}),
+                dict(_wheel_url('foo-1.0-py3-none-any.whl', server),
+                     **{'core-metadata': {'sha256': hashlib.sha256(metadata).hexdigest()}})])
+            code = py2pack.run('--no-cache', 'generate', 'foo', '--core-metadata',
+                               '-t', 'opensuse.spec', '-f', os.path.join(tmpdir, 'foo.spec'))
+        self.assertEqual(code, 0)
+        self.assertEqual([path for path, _ in server.requests], ['/foo-1.0-py3-none-any.whl.metadata'])
+        with open(os.path.join(tmpdir, 'foo.spec')) as f:
+            spec = f.read()
+        self.assertIn('Requires:       python-bar >= 2.0', spec)
+        self.assertNotIn('baz', spec)
+
+    def test_generate_wheel(self):
+        tmpdir = self._tmpdir()
+        wheel = io.BytesIO()
+        with zipfile.ZipFile(wheel, 'w') as zip_file:
+            zip_file.writestr('foo/__init__.py', 'x = 1\n')
+            zip_file.writestr('foo-1.0.dist-info/METADATA',
+                              'Metadata-Version: 2.1\nName: foo\nVersion: 1.0\nRequires-Dist: bar>=2.0\n')
+            zip_file.writestr('foo-1.0.dist-info/entry_points.txt',
+                              '[console_scripts]\nfoo = foo:main\n')
+        routes = {'/foo-1.0-py3-none-any.whl': (200, {}, wheel.getvalue())}
+
+        with LocalHTTPServer(routes) as server:
+            self._mock_pypi_json(lambda project: [
+                _sdist_url(project, server.url('/foo-1.0.tar.gz')),
+                _wheel_url('foo-1.0-cp311-cp311-manylinux_2_17_x86_64.whl', server),
+                _wheel_url('foo-1.0-py3-none-any.whl', server)])
+            code = py2pack.run('--no-cache', 'generate', 'foo', '--wheel',
+                               '-t', 'opensuse.spec', '-f', os.path.join(tmpdir, 'foo.spec'))
+        self.assertEqual(code, 0)
+        self.assertEqual({path for path, _ in server.requests}, {'/foo-1.0-py3-none-any.whl'})
+        with open(os.path.join(tmpdir, 'foo.spec')) as f:
+            spec = f.read()
+        self.assertIn('Requires:       python-bar >= 2.0', spec)
+        self.assertIn('%python_clone -a %{buildroot}%{_bindir}/foo', spec)
+        self.assertNotIn('noarch', spec)
+
+    def test_generate_localfile_wheel(self):
+        tmpdir = self._tmpdir()
+        wheel = os.path.join(tmpdir, 'foo-1.0-py3-none-any.whl')
+        with zipfile.ZipFile(wheel, 'w') as zip_file:
+            zip_file.writestr('foo/__init__.py', 'x = 1\n')
+            zip_file.writestr('foo/_speedups.cpython-311-x86_64-linux-gnu.so', '')
+            zip_file.writestr('foo-1.0.dist-info/METADATA',
+                              'Metadata-Version: 2.1\nName: foo\nVersion: 1.0\nSummary: Summary\n'
+                              'Requires-Dist: bar>=2.0\n')
+            zip_file.writestr('foo-1.0.dist-info/entry_points.txt', '[console_scripts]\nfoo = foo:main\n')
+            zip_file.writestr('foo-1.0.dist-info/RECORD',
+                              'foo/__init__.py,,\nfoo/_speedups.cpython-311-x86_64-linux-gnu.so,,\n')
+
+        with mock.patch('py2pack.sandbox.from_archive', side_effect=AssertionError('setup.py run')):
+            code = py2pack.run('--no-cache', 'generate', '--localfile', wheel,
+                               '-t', 'opensuse.spec', '-f', os.path.join(tmpdir, 'foo.spec'))
+        self.assertEqual(code, 0)
+        with open(os.path.join(tmpdir, 'foo.spec')) as f:
+            spec = f.read()
+        self.assertIn('Requires:       python-bar >= 2.0', spec)
+        self.assertIn('%python_clone -a %{buildroot}%{_bindir}/foo', spec)
+        self.assertNotIn('noarch', spec)
+
+    def test__augment_data_from_tarball_static_metadata(self):
+        tmpdir = self._tmpdir()
+        sdist = os.path.join(tmpdir, 'foo-1.0.tar.gz')
+        pyproject = os.path.join(tmpdir, 'pyproject.toml')
+        with open(pyproject, 'w') as f:
+            f.write('[build-system]\nrequires = ["flit_core"]\n'
+                    '[project]\nname = "foo"\nversion = "1.0"\ndependencies = ["bar"]\n')
+        with tarfile.open(sdist, 'w:gz') as tar:
+            tar.add(pyproject, 'foo-1.0/pyproject.toml')
+        data = {'name': 'foo'}
+        with mock.patch('py2pack.get_metadata', side_effect=AssertionError('built')):
+            py2pack._augment_data_from_tarball(Munch({'name': 'foo', 'version': '1.0'}), sdist, data)
+        self.assertEqual(data['metadata_source'], 'pyproject.toml')
+        self.assertEqual(data['install_requires'], ['bar'])
+
+    def test__augment_data_from_tarball_cached(self):
+        tmpdir = self._tmpdir()
+        sdist = os.path.join(tmpdir, 'foo-1.0.tar.gz')
+        setup_py = os.path.join(tmpdir, 'setup.py')
+        with open(setup_py, 'w') as f:
+            f.write('raise SystemExit("not run")\n')
+        with tarfile.open(sdist, 'w:gz') as tar:
+            tar.add(setup_py, 'foo-1.0/setup.py')
+            tar.add(setup_py, 'foo-1.0/README')
+        args = Munch({'name': 'foo', 'version': '1.0', 'cache_dir': tmpdir,
+                      'cache': py2pack.cache.HTTPCache(os.path.join(tmpdir, 'http'))})
+        results = [RuntimeError('flaky'), {'data': {'install_requires': ['bar']}}]
+
+        def from_archive(filename):
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        augmented = []
+        with mock.patch('py2pack.sandbox.from_archive', from_archive), \
+                warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for user_name in ('tester', 'tester', 'other'):
+                data = {'name': 'foo', 'user_name': user_name}
+                py2pack._augment_data_from_tarball(args, sdist, data)
+                augmented.append(data)
+        # the failed analysis is not cached, the complete one is used again
+        self.assertEqual(results, [])
+        self.assertNotIn('install_requires', augmented[0])
+        self.assertEqual(augmented[1]['install_requires'], ['bar'])
+        self.assertEqual(augmented[1]['doc_files'], ['README'])
+        self.assertEqual(dict(augmented[1], user_name='other'), augmented[2])
+
+        # another interpreter evaluates the markers differently
+        results.append({'data': {'install_requires': ['baz']}})
+        environment = dict(py2pack.default_environment(), python_version='2.7')
+        with mock.patch('py2pack.sandbox.from_archive', from_archive), \
+                mock.patch('py2pack.default_environment', return_value=environment):
+            data = {'name': 'foo', 'user_name': 'tester'}
+            py2pack._augment_data_from_tarball(args, sdist, data)
+        self.assertEqual(results, [])
+        self.assertEqual(data['install_requires'], ['baz'])
+
+    def test_generate_many_recursive(self):
+        tmpdir = self._tmpdir()
+        existing = os.path.join(tmpdir, 'existing')
+        os.mkdir(existing)
+        os.mkdir(os.path.join(existing, 'python-Skipped'))
+        requires = {
+            'app': ['lib-a>=1', 'Lib_B', 'skipped', "winonly; sys_platform == 'win32'"],
+            'lib-a': ['lib_b', 'lib-c[extra]'],
+            'lib-b': [],
+            'lib-c': ["lib-a; extra == 'test'"],
+        }
+        self._mock_pypi_json(lambda project: [_sdist_url(project)],
+                             requires_dist=lambda project: requires[canonicalize_name(project)])
+        code = py2pack.run('--no-cache', 'generate-many', 'app', '--recursive', '-d', tmpdir,
+                           '--skip-existing', existing, '-t', 'opensuse.spec')
+        self.assertEqual(code, 0)
+        self.assertEqual(sorted(self.fetched), ['Lib_B', 'app', 'lib-a', 'lib-c'])
+        self.assertEqual(sorted(f for f in os.listdir(tmpdir) if f.endswith('.spec')),
+                         ['python-Lib_B.spec', 'python-app.spec',
+                          'python-lib-a.spec', 'python-lib-c.spec'])
+
     def test_newest_download_url(self):
         mun = Munch({'name': self.args[0], 'version': self.args[1]})
         py2pack.fetch_data(mun)
@@ -73,3 +73,16 @@ class Py2packRequiresTestCase(unittest.TestCase):
     @unpack
     def test__requirements_sanitize(self, req_list, expected):
         self.assertEqual(py2pack.requires._requirements_sanitize(req_list), expected)
+
+    def test__requirements_sanitize_cached(self):
+        py2pack.requires.cache_clear()
+        req_list = ["foo>=1.0; python_version>='3'", "bar; python_version>='3'", "foo>=1.0; python_version>='3'"]
+        expected = ["foo >= 1.0", "bar", "foo >= 1.0"]
+        self.assertEqual(py2pack.requires._requirements_sanitize(req_list), expected)
+        self.assertEqual(py2pack.requires._requirements_sanitize(req_list), expected)
+        info = py2pack.requires.cache_info()
+        self.assertEqual((info['sanitized'].hits, info['sanitized'].misses), (4, 2))
+        self.assertEqual((info['requirements'].hits, info['requirements'].misses), (0, 2))
+        self.assertEqual((info['markers'].hits, info['markers'].misses), (1, 1))
+        self.assertIs(py2pack.requires._parse_requirement("foo>=1.0; python_version>='3'"),
+                      py2pack.requires._parse_requirement("foo>=1.0; python_version>='3'"))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import concurrent.futures
+import multiprocessing
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import unittest
+
+import py2pack
+import py2pack.sandbox
+
+SETUP_PY = '''
+from setuptools import setup
+{}
+setup(name='foo', version='1.0', install_requires=['bar'])
+'''
+
+
+class Py2packSandboxTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='py2pack_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _create_sdist(self, code='', name='foo-1.0.tar.gz'):
+        setup_py = os.path.join(self.tmpdir, 'setup.py')
+        with open(setup_py, 'w') as f:
+            f.write(SETUP_PY.format(code))
+        sdist = os.path.join(self.tmpdir, name)
+        with tarfile.open(sdist, 'w:gz') as tar:
+            tar.add(setup_py, 'foo-1.0/setup.py')
+        return sdist
+
+    def test_from_archive(self):
+        pool = py2pack.sandbox.SetupPyPool()
+        data = pool.from_archive(self._create_sdist())
+        self.assertEqual(data['data']['install_requires'], ['bar'])
+        self.assertEqual(pool.max_workers, os.cpu_count())
+
+    def test_timeout(self):
+        pool = py2pack.sandbox.SetupPyPool(timeout=1)
+        started = time.monotonic()
+        with self.assertRaises(py2pack.sandbox.SetupPyTimeout):
+            pool.from_archive(self._create_sdist('import time; time.sleep(60)'))
+        self.assertLess(time.monotonic() - started, 30)
+
+    def test_memory_limit(self):
+        pool = py2pack.sandbox.SetupPyPool(memory=256)
+        with self.assertRaises(py2pack.sandbox.SetupPyError):
+            pool.from_archive(self._create_sdist('x = bytearray(2 ** 30)'))
+
+    def test_failure(self):
+        pool = py2pack.sandbox.SetupPyPool()
+        with self.assertRaisesRegex(py2pack.sandbox.SetupPyError, 'does not exist'):
+            pool.from_archive(os.path.join(self.tmpdir, 'missing.tar.gz'))
+
+    def test_slots_shared_between_processes(self):
+        # every setup.py appends its start and end time to the log
+        log = os.path.join(self.tmpdir, 'log')
+        code = ('import time\n'
+                'def log(event):\n'
+                '    with open({0!r}, "a") as f:\n'
+                '        f.write("%s %f\\n" % (event, time.time()))\n'
+                'log("start"); time.sleep(0.5); log("end")\n').format(log)
+        sdists = [self._create_sdist(code, 'foo-1.0.{0}.tar.gz'.format(i)) for i in range(3)]
+        context = multiprocessing.get_context('spawn')
+        slots = context.BoundedSemaphore(1)
+        with concurrent.futures.ProcessPoolExecutor(
+                3, mp_context=context, initializer=py2pack._configure_setup_py_pool,
+                initargs=({'max_workers': 3}, slots)) as processes:
+            for result in processes.map(py2pack.sandbox.from_archive, sdists):
+                self.assertEqual(result['data']['install_requires'], ['bar'])
+        running = maximum = 0
+        with open(log) as f:
+            for event, _ in sorted((line.split() for line in f), key=lambda e: float(e[1])):
+                running += 1 if event == 'start' else -1
+                maximum = max(maximum, running)
+        self.assertEqual(maximum, 1)
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import pathlib
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from ddt import ddt, data
+
+import py2pack.static
+from py2pack.utils import ArchiveIndex
+
+SETUP_PY = '''
+"""Setup for foo"""
+import os
+from setuptools import setup, find_packages
+
+here = os.path.abspath(os.path.dirname(__file__))
+with open(os.path.join(here, 'README.rst')) as f:
+    README = f.read()
+
+REQUIRES = ['bar>=1.0']
+TESTS_REQUIRE = ['pytest']
+
+if __name__ == '__main__':
+    setup(name='foo', version=__import__('foo').__version__, description='Foo tool',
+          long_description=README, license='MIT', packages=find_packages(),
+          install_requires=REQUIRES + ['baz'], extras_require={'x': 'a\\nb'},
+          tests_require=TESTS_REQUIRE, entry_points={'console_scripts': ['foo = foo:main']},
+          data_files=[('share/foo', ['foo.conf'])], scripts=['bin/foo'])
+'''
+
+SETUP_CFG = '''
+[metadata]
+name = foo
+version = attr: foo.__version__
+description = Foo tool
+long_description = file: README.rst
+classifiers =
+    License :: OSI Approved :: MIT License
+
+[options]
+install_requires =
+    bar>=1.0
+    # comment
+    baz; python_version < "3.8"
+setup_requires = setuptools_scm
+scripts = bin/foo
+
+[options.extras_require]
+x = a; b
+
+[options.entry_points]
+console_scripts =
+    foo = foo:main
+
+[options.data_files]
+share/foo = foo.conf, bar.conf
+'''
+
+PKG_INFO = """Metadata-Version: 2.2
+Name: foo
+Version: 1.0
+Summary: Foo tool
+Requires-Dist: bar>=1.0
+
+Foo
+"""
+
+PYPROJECT = """
+[project]
+name = "foo"
+version = "1.0"
+description = "Foo tool"
+readme = "README.rst"
+license = {text = "MIT"}
+keywords = ["foo", "tool"]
+authors = [{name = "Jane"}, {name = "John", email = "john@example.org"}]
+dependencies = ["bar>=1.0"]
+"""
+
+
+@ddt
+class Py2packStaticTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='py2pack_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _index(self, files):
+        sdist = os.path.join(self.tmpdir, 'foo-1.0.tar.gz')
+        with tarfile.open(sdist, 'w:gz') as tar:
+            for name, content in dict(files, **{'README.rst': 'Foo\n'}).items():
+                info = tarfile.TarInfo('foo-1.0/' + name)
+                info.size = len(content.encode('utf-8'))
+                tar.addfile(info, io.BytesIO(content.encode('utf-8')))
+        return ArchiveIndex(sdist)
+
+    def test_setup_py(self):
+        metadata = py2pack.static.setup_metadata(self._index({'setup.py': SETUP_PY}))
+        self.assertEqual(metadata['install_requires'], ['bar>=1.0', 'baz'])
+        self.assertEqual(metadata['extras_require'], {'x': ['a', 'b']})
+        self.assertEqual(metadata['tests_require'], ['pytest'])
+        self.assertEqual(metadata['setup_requires'], [])
+        self.assertEqual(metadata['entry_points'], {'console_scripts': ['foo = foo:main']})
+        self.assertEqual(metadata['data_files'], [['share/foo', ['foo.conf']]])
+        self.assertEqual(metadata['scripts'], ['bin/foo'])
+        self.assertEqual(metadata['description'], 'Foo tool')
+        self.assertIsNone(metadata['has_ext_modules'])
+        self.assertEqual(metadata['name'], 'foo')
+        self.assertNotIn('version', metadata)
+        self.assertNotIn('long_description', metadata)
+
+    def test_setup_cfg(self):
+        metadata = py2pack.static.setup_metadata(self._index({
+            'setup.py': 'import setuptools\nsetuptools.setup(license="MIT")\n',
+            'setup.cfg': SETUP_CFG}))
+        self.assertEqual(metadata['install_requires'], ['bar>=1.0', 'baz; python_version < "3.8"'])
+        self.assertEqual(metadata['setup_requires'], ['setuptools_scm'])
+        self.assertEqual(metadata['extras_require'], {'x': ['a', 'b']})
+        self.assertEqual(metadata['entry_points'], {'console_scripts': ['foo = foo:main']})
+        self.assertEqual(metadata['data_files'], [['share/foo', ['foo.conf', 'bar.conf']]])
+        self.assertEqual(metadata['classifiers'], ['License :: OSI Approved :: MIT License'])
+        self.assertEqual(metadata['long_description'], 'Foo\n')
+        self.assertEqual(metadata['license'], 'MIT')
+        self.assertNotIn('version', metadata)
+
+    def test_setup_cfg_requirements(self):
+        metadata = py2pack.static.setup_metadata(self._index({
+            'setup.cfg': '[options]\ninstall_requires = bar>=1,<2; baz\n'
+                         'tests_require = file: requirements-test.txt\n',
+            'requirements-test.txt': '# tests\npytest>=7\nmock\n'}))
+        self.assertEqual(metadata['install_requires'], ['bar>=1,<2', 'baz'])
+        self.assertEqual(metadata['tests_require'], ['mock', 'pytest>=7'])
+
+    @data('install_requires = -r requirements.txt\n',
+          'install_requires = file: requirements.txt\n')
+    def test_setup_cfg_invalid_requirements(self, option):
+        self.assertIsNone(py2pack.static.setup_metadata(self._index({
+            'setup.cfg': '[options]\n' + option,
+            'requirements.txt': '--index-url https://example.org\nbar\n'})))
+
+    def test_setup_cfg_without_setup_py(self):
+        metadata = py2pack.static.setup_metadata(self._index({'setup.cfg': SETUP_CFG}))
+        self.assertEqual(metadata['scripts'], ['bin/foo'])
+
+    @data(
+        # requirements computed by code
+        "from setuptools import setup\nREQUIRES = ['bar']\nREQUIRES.append('baz')\n"
+        "setup(install_requires=REQUIRES)\n",
+        "from setuptools import setup\nfrom helpers import add\nREQUIRES = ['a']\nadd(REQUIRES)\n"
+        "setup(install_requires=REQUIRES)\n",
+        "from setuptools import setup\nREQUIRES = ['a']\nR2 = REQUIRES\nR2.append('b')\n"
+        "setup(install_requires=REQUIRES)\n",
+        "from setuptools import setup\nimport sys\nREQUIRES = ['bar']\n"
+        "if sys.version_info < (3,):\n    REQUIRES = ['bar<2']\nsetup(install_requires=REQUIRES)\n",
+        "from setuptools import setup\nsetup(install_requires=open('requirements.txt').readlines())\n",
+        # setup() called indirectly or with computed arguments
+        "from setuptools import setup\ndef run():\n    setup(name='foo')\nrun()\n",
+        "from setuptools import setup\nsetup(**{'name': 'foo'})\n",
+        "from setuptools import setup, Extension\nsetup(ext_modules=[Extension(n, [n]) for n in 'ab'])\n",
+        "from setuptools import setup\nsetup(cffi_modules=['build.py:ffi'])\n",
+        # metadata of plugins
+        "import setuptools\nsetuptools.setup(setup_requires=['pbr>=2.0.0'], pbr=True)\n",
+        "import setuptools\nsetuptools.setup(setup_requires=['pbr'])\n",
+        "print 'python 2'\n",
+    )
+    def test_dynamic(self, setup_py):
+        self.assertIsNone(py2pack.static.setup_metadata(self._index({'setup.py': setup_py})))
+
+    @data(
+        # pbr reads the requirements from requirements.txt
+        '[metadata]\nname = foo\ndescription-file = README.rst\n',
+        '[metadata]\nname = foo\n\n[entry_points]\nconsole_scripts =\n    foo = foo:main\n',
+        '[metadata]\nname = foo\n\n[files]\npackages = foo\n',
+        '[options]\nsetup_requires = pbr\n',
+        '[options.unknown]\nfoo = bar\n',
+    )
+    def test_dynamic_setup_cfg(self, setup_cfg):
+        self.assertIsNone(py2pack.static.setup_metadata(self._index({
+            'setup.py': 'import setuptools\nsetuptools.setup()\n',
+            'setup.cfg': setup_cfg, 'requirements.txt': 'bar\n'})))
+
+    def test_ext_modules(self):
+        metadata = py2pack.static.setup_metadata(self._index({
+            'setup.py': "from setuptools import setup, Extension\n"
+                        "setup(ext_modules=[Extension('foo._speedups', ['foo/_speedups.c'])])\n"}))
+        self.assertTrue(metadata['has_ext_modules'])
+
+    def test_pyproject_project_table(self):
+        self.assertIsNone(py2pack.static.setup_metadata(self._index({
+            'setup.py': 'from setuptools import setup\nsetup()\n',
+            'pyproject.toml': '[project]\nname = "foo"\nversion = "1.0"\n'})))
+
+    def test_core_metadata_pkg_info(self):
+        metadata, source = py2pack.static.core_metadata(self._index({
+            'PKG-INFO': PKG_INFO,
+            'pyproject.toml': '[project]\nname = "foo"\ndynamic = ["version"]\n'}))
+        self.assertEqual(source, 'PKG-INFO')
+        self.assertEqual(metadata['install_requires'], ['bar>=1.0'])
+        self.assertEqual(metadata['summary'], 'Foo tool')
+        self.assertEqual(metadata['description'], 'Foo\n')
+
+    def test_pkg_info_distribution(self):
+        distribution = py2pack.static._PkgInfoDistribution(PKG_INFO, 'foo-1.0')
+        self.assertEqual(distribution.version, '1.0')
+        self.assertEqual(distribution.requires, ['bar>=1.0'])
+        self.assertEqual(distribution.locate_file('foo/__init__.py'), pathlib.Path('foo-1.0/foo/__init__.py'))
+
+    @data('Metadata-Version: 2.1\n', 'Metadata-Version: 2.2\nDynamic: Requires-Dist\n')
+    def test_core_metadata_pyproject(self, header):
+        metadata, source = py2pack.static.core_metadata(self._index({
+            'PKG-INFO': header + PKG_INFO.split('\n', 1)[1],
+            'pyproject.toml': PYPROJECT}))
+        self.assertEqual(source, 'pyproject.toml')
+        self.assertEqual(metadata['install_requires'], ['bar>=1.0'])
+        self.assertEqual(metadata['summary'], 'Foo tool')
+        self.assertEqual(metadata['description'], 'Foo\n')
+        self.assertEqual(metadata['author'], 'Jane')
+        self.assertEqual(metadata['author_email'], 'John <john@example.org>')
+        self.assertEqual(metadata['keywords'], 'foo,tool')
+        self.assertEqual(metadata['license'], 'MIT')
+
+    def test_core_metadata_dynamic(self):
+        self.assertEqual(py2pack.static.core_metadata(self._index({
+            'PKG-INFO': 'Metadata-Version: 2.1\nName: foo\nVersion: 1.0\n',
+            'pyproject.toml': '[project]\nname = "foo"\ndynamic = ["version"]\n'})),
+            (None, None))
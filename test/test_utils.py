@@ -15,13 +15,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import email
+import io
 import os
 import shutil
 import tarfile
 import tempfile
 import unittest
+import zipfile
+from unittest import mock
 
 import py2pack.utils
+from test.http_server import LocalHTTPServer
 
 
 class Py2packUtilsTestCase(unittest.TestCase):
@@ -69,6 +74,102 @@ class Py2packUtilsTestCase(unittest.TestCase):
         files = py2pack.utils._get_archive_filelist(file_name)
         self.assertEqual(expected_files, files)
 
+    def test__get_archive_filelist_url(self):
+        with open(self._create_zipfile(), 'rb') as f:
+            body = f.read()
+        with LocalHTTPServer({'/file.zip': (200, {}, body)}) as server:
+            files = py2pack.utils._get_archive_filelist(server.url('/file.zip'))
+        self.assertEqual(["file1", "file2", "file3"], files)
+
+    def _create_sdist(self, name):
+        sdist = os.path.join(self.tmpdir, name)
+        files = {'foo-1.0/PKG-INFO': 'Metadata-Version: 2.1\nName: foo\nVersion: 1.0\n',
+                 'foo-1.0/pyproject.toml': '[build-system]\nrequires = ["flit_core"]\n',
+                 'foo-1.0/README.rst': 'Foo\n',
+                 'foo-1.0/requirements-test.txt': 'pytest\n',
+                 'foo-1.0/foo/__init__.py': 'x = 1\n'}
+        for member, content in files.items():
+            path = os.path.join(self.tmpdir, 'src', member)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(content)
+        if name.endswith('.zip'):
+            with zipfile.ZipFile(sdist, 'w') as zip_file:
+                for member in files:
+                    zip_file.write(os.path.join(self.tmpdir, 'src', member), member)
+        else:
+            with tarfile.open(sdist, 'w:gz') as tar:
+                tar.add(os.path.join(self.tmpdir, 'src', 'foo-1.0'), arcname='foo-1.0')
+        return sdist
+
+    def test_archive_index(self):
+        for name in ('foo-1.0.tar.gz', 'foo-1.0.zip'):
+            index = py2pack.utils.ArchiveIndex(self._create_sdist(name))
+            self.assertIn('foo-1.0/foo/__init__.py', index.names)
+            self.assertEqual(sorted(index.files), ['foo-1.0/PKG-INFO', 'foo-1.0/README.rst',
+                                                   'foo-1.0/pyproject.toml', 'foo-1.0/requirements-test.txt'])
+            self.assertEqual(index.read('foo-1.0/foo/__init__.py'), b'x = 1\n')
+            self.assertEqual(py2pack.utils._get_archive_filelist(index),
+                             py2pack.utils._get_archive_filelist(index.filename))
+            self.assertEqual(py2pack.utils.parse_pyproject(index),
+                             {'build-system': {'requires': ['flit_core']}})
+            self.assertEqual(py2pack.utils.pypi_archive_file(index)['info']['name'], 'foo')
+
+    def test_archive_index_for_archive_is_stored(self):
+        sdist = self._create_sdist('foo-1.0.tar.gz')
+        directory = os.path.join(self.tmpdir, 'archives')
+        index = py2pack.utils.ArchiveIndex.for_archive(sdist, directory)
+        self.assertEqual(os.listdir(directory), [index.digest + '.idx'])
+        with mock.patch('tarfile.open', side_effect=AssertionError('archive reopened')):
+            loaded = py2pack.utils.ArchiveIndex.for_archive(sdist, directory)
+            self.assertEqual(py2pack.utils.parse_pyproject(loaded),
+                             {'build-system': {'requires': ['flit_core']}})
+            self.assertEqual(loaded.read('foo-1.0/requirements-test.txt'), b'pytest\n')
+            self.assertEqual(loaded.read('foo-1.0/README.rst'), b'Foo\n')
+        self.assertEqual(loaded.names, index.names)
+
+    def test_archive_index_for_archive_evicts(self):
+        directory = os.path.join(self.tmpdir, 'archives')
+        with mock.patch.object(py2pack.utils.ArchiveIndex, 'MAX_STORED_INDEXES', 1):
+            old = py2pack.utils.ArchiveIndex.for_archive(self._create_sdist('foo-1.0.tar.gz'), directory)
+            os.utime(os.path.join(directory, old.digest + '.idx'), (0, 0))
+            index = py2pack.utils.ArchiveIndex.for_archive(self._create_sdist('foo-1.0.zip'), directory)
+        self.assertEqual(os.listdir(directory), [index.digest + '.idx'])
+
+    def test__extract_to_tempdir_selective(self):
+        sdist = self._create_sdist('foo-1.0.tar.gz')
+        cwd = os.getcwd()
+        with py2pack.utils._extract_to_tempdir(sdist, lambda name: name.endswith('.toml'),
+                                               work_dir=self.tmpdir) as tempdir:
+            self.assertEqual(os.getcwd(), cwd)
+            self.assertEqual(os.path.dirname(tempdir), self.tmpdir)
+            self.assertEqual(os.listdir(os.path.join(tempdir, 'foo-1.0')), ['pyproject.toml'])
+        self.assertFalse(os.path.exists(tempdir))
+
+    def test_get_metadata_retries_with_all_files(self):
+        sdist = self._create_sdist('foo-1.0.zip')
+        with zipfile.ZipFile(sdist, 'a') as zip_file:
+            zip_file.writestr('foo-1.0/docs/README.rst', 'read me')
+        extracted = []
+
+        def project_wheel_metadata(path, isolated=True):
+            readme = os.path.join(path, 'docs', 'README.rst')
+            extracted.append(os.path.exists(readme))
+            with open(readme) as f:
+                return email.message_from_string('Name: foo\nDescription: ' + f.read())
+
+        with mock.patch('py2pack.utils.project_wheel_metadata', project_wheel_metadata):
+            data = py2pack.utils.get_metadata(sdist)
+        self.assertEqual(extracted, [False, True])
+        self.assertEqual(data['description'], 'read me')
+
+    def test_archive_index_invalid_archive(self):
+        file_name = os.path.join(self.tmpdir, "file.txt")
+        with open(file_name, "w") as txt_file:
+            txt_file.write('')
+        with self.assertRaises(ValueError):
+            py2pack.utils.ArchiveIndex(file_name)
+
     def test__get_archive_filelist_invalid_archive(self):
         file_name = os.path.join(self.tmpdir, "file.txt")
         # poor man's touch
@@ -97,3 +198,51 @@ class Py2packUtilsTestCase(unittest.TestCase):
 
         self.assertNotIn(
             "Not a tar or zip file", str(f_not_found_err.exception))
+
+    def test_wheel_is_pure(self):
+        self.assertTrue(py2pack.utils.wheel_is_pure('foo-1.0-py2.py3-none-any.whl'))
+        self.assertFalse(py2pack.utils.wheel_is_pure('foo-1.0-cp311-abi3-manylinux_2_17_x86_64.whl'))
+        self.assertFalse(py2pack.utils.wheel_is_pure('foo-1.0.tar.gz'))
+
+    def test_pypi_archive_file_wheel(self):
+        wheel = os.path.join(self.tmpdir, 'foo-1.0-py3-none-any.whl')
+        with zipfile.ZipFile(wheel, 'w') as zip_file:
+            zip_file.writestr('foo/__init__.py', 'x = 1\n')
+            zip_file.writestr('foo-1.0.dist-info/METADATA',
+                              'Metadata-Version: 2.1\nName: foo\nVersion: 1.0\nRequires-Dist: bar\n')
+        info = py2pack.utils.pypi_archive_file(wheel)['info']
+        self.assertEqual((info['name'], info['version'], info['requires_dist']), ('foo', '1.0', ['bar']))
+        self.assertEqual(py2pack.utils.pypi_archive_file(py2pack.utils.ArchiveIndex(wheel))['info'], info)
+
+    def test_record_has_ext_modules(self):
+        self.assertTrue(py2pack.utils.record_has_ext_modules(
+            'foo/__init__.py,sha256=abc,6\nfoo/_speedups.cpython-311-x86_64-linux-gnu.so,sha256=def,10\n'))
+        self.assertFalse(py2pack.utils.record_has_ext_modules(
+            'foo/__init__.py,sha256=abc,6\nfoo-1.0.dist-info/RECORD,,\n'))
+
+    def test_archive_index_streaming(self):
+        sdist = os.path.join(self.tmpdir, 'foo-1.0.tar.gz')
+        members = (['foo-1.0/PKG-INFO', 'foo-1.0/LICENSES/MIT.txt'] +
+                   ['foo-1.0/data/{0}.json'.format(i) for i in range(100)] +
+                   ['foo-1.0/tests/test_a.py', 'foo-1.0/tests/test_b.py'])
+        with tarfile.open(sdist, 'w:gz') as tar:
+            for member in members:
+                content = 'Metadata-Version: 2.1\nName: foo\nVersion: 1.0\n' if member.endswith('PKG-INFO') else member
+                info = tarfile.TarInfo(member)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content.encode('utf-8')))
+        index = py2pack.utils.ArchiveIndex(sdist, streaming=True)
+        self.assertEqual(index.names, ['foo-1.0/LICENSES/MIT.txt', 'foo-1.0/PKG-INFO',
+                                       'foo-1.0/data/0.json', 'foo-1.0/tests/test_a.py'])
+        self.assertEqual(index.tags, {'license_files': ['foo-1.0/LICENSES/MIT.txt'], 'testsuite': True})
+        self.assertEqual(index.read('foo-1.0/data/42.json'), b'foo-1.0/data/42.json')
+        with self.assertRaises(KeyError):
+            index.read('foo-1.0/missing')
+        self.assertEqual(py2pack.utils.pypi_archive_file(index)['info']['name'], 'foo')
+        self.assertEqual(py2pack.utils.ArchiveIndex(sdist).names, sorted(members))
+
+    def test__iter_tar(self):
+        with tarfile.open(self._create_tarfile()) as tar_file:
+            names = [member.name for member in py2pack.utils._iter_tar(tar_file)]
+            self.assertEqual(tar_file.members, [])
+        self.assertEqual(sorted(names), ['file1', 'file2', 'file3'])